@@ -3,13 +3,19 @@ Streamlit admin application for the Financial Assistant.
 """
 import streamlit as st
 import requests
+from api_client import API_BASE_URL, get_session, fetch_debounced
+import time
+from collections import Counter
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 
 # Configuration
-API_BASE_URL = "http://localhost:8000"
+TRAINING_MAX_WAIT_SECONDS = 600
+TRAINING_POLL_SECONDS = 2
+CACHE_TTL_SECONDS = 60
+FIGURE_CACHE_MAX_ENTRIES = 256  # Figure caches are shared by every session in the process
 
 # Page configuration
 st.set_page_config(
@@ -49,7 +55,7 @@ st.markdown("""
 def authenticate_admin(username: str, password: str) -> dict:
     """Authenticate admin user and get access token."""
     try:
-        response = requests.post(
+        response = get_session().post(
             f"{API_BASE_URL}/token",
             data={"username": username, "password": password}
         )
@@ -62,11 +68,12 @@ def authenticate_admin(username: str, password: str) -> dict:
         return None
 
 
-def get_admin_dashboard(token: str) -> dict:
-    """Get admin dashboard data."""
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def get_admin_bootstrap(token: str) -> dict:
+    """Get dashboard data, users and model status in one request."""
     try:
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(f"{API_BASE_URL}/api/admin/dashboard", headers=headers)
+        response = get_session().get(f"{API_BASE_URL}/api/admin/bootstrap", headers=headers)
         if response.status_code == 200:
             return response.json()
         else:
@@ -75,11 +82,16 @@ def get_admin_dashboard(token: str) -> dict:
         return None
 
 
-def get_all_users(token: str) -> dict:
-    """Get all users data."""
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def get_all_users(token: str, page: int, page_size: int) -> dict:
+    """Get one page of users data."""
     try:
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(f"{API_BASE_URL}/api/admin/users", headers=headers)
+        response = get_session().get(
+            f"{API_BASE_URL}/api/admin/users",
+            headers=headers,
+            params={"page": page, "page_size": page_size}
+        )
         if response.status_code == 200:
             return response.json()
         else:
@@ -88,30 +100,81 @@ def get_all_users(token: str) -> dict:
         return None
 
 
-def train_clustering_model(token: str) -> dict:
-    """Train clustering model."""
+def run_training_job(token: str, path: str) -> dict:
+    """Queue a training job and poll until it finishes."""
     try:
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.post(f"{API_BASE_URL}/api/admin/train-clustering", headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
+        response = get_session().post(f"{API_BASE_URL}{path}", headers=headers)
+        if response.status_code == 409:
+            return {"error": response.json()["detail"]}
+        if response.status_code != 202:
             return {"error": f"HTTP {response.status_code}"}
+        
+        job_id = response.json()["job_id"]
+        deadline = time.monotonic() + TRAINING_MAX_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            response = get_session().get(f"{API_BASE_URL}/api/admin/jobs/{job_id}", headers=headers)
+            if response.status_code != 200:
+                return {"error": f"HTTP {response.status_code}"}
+            job = response.json()
+            if job["status"] in ("completed", "failed"):
+                return job["result"]
+            time.sleep(TRAINING_POLL_SECONDS)
+        return {"error": "Training is still running, check the model status later"}
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
 
+def train_clustering_model(token: str) -> dict:
+    """Train clustering model."""
+    return run_training_job(token, "/api/admin/train-clustering")
+
+
 def train_recommendation_model(token: str) -> dict:
     """Train recommendation model."""
-    try:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.post(f"{API_BASE_URL}/api/admin/train-recommendations", headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"error": f"HTTP {response.status_code}"}
-    except requests.exceptions.RequestException as e:
-        return {"error": str(e)}
+    return run_training_job(token, "/api/admin/train-recommendations")
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=FIGURE_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_cluster_pie(cluster_dist: dict) -> go.Figure:
+    """Build the customer segmentation pie chart."""
+    fig = px.pie(
+        values=list(cluster_dist.values()),
+        names=list(cluster_dist.keys()),
+        title="Customer Distribution by Cluster"
+    )
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    return fig
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=FIGURE_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_health_bar(health_metrics: dict) -> go.Figure:
+    """Build the key system metrics bar chart."""
+    fig = go.Figure(data=[
+        go.Bar(
+            x=list(health_metrics.keys()),
+            y=list(health_metrics.values()),
+            marker_color=['#1f77b4', '#ff7f0e', '#2ca02c']
+        )
+    ])
+    
+    fig.update_layout(
+        title="Key System Metrics",
+        yaxis_title="Value",
+        showlegend=False
+    )
+    return fig
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=FIGURE_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_cluster_bar(cluster_counts: dict) -> go.Figure:
+    """Build the users-per-cluster bar chart."""
+    return px.bar(
+        x=list(cluster_counts.keys()),
+        y=list(cluster_counts.values()),
+        title="Users per Cluster",
+        labels={'x': 'Cluster', 'y': 'Number of Users'}
+    )
 
 
 def login_page():
@@ -143,16 +206,11 @@ def login_page():
                     st.error("❌ Invalid admin credentials. Please try again.")
 
 
-def dashboard_overview(token: str):
+def dashboard_overview(bootstrap: dict):
     """Display dashboard overview."""
     st.markdown("### 📊 System Overview")
     
-    with st.spinner("Loading dashboard data..."):
-        dashboard_data = get_admin_dashboard(token)
-    
-    if not dashboard_data:
-        st.error("❌ Failed to load dashboard data.")
-        return
+    dashboard_data = bootstrap["dashboard"]
     
     # Key metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -189,13 +247,7 @@ def dashboard_overview(token: str):
         cluster_dist = dashboard_data["cluster_distribution"]
         
         if cluster_dist:
-            fig = px.pie(
-                values=list(cluster_dist.values()),
-                names=list(cluster_dist.keys()),
-                title="Customer Distribution by Cluster"
-            )
-            fig.update_traces(textposition='inside', textinfo='percent+label')
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(build_cluster_pie(cluster_dist), use_container_width=True)
         else:
             st.info("No cluster data available. Train the clustering model first.")
     
@@ -209,93 +261,74 @@ def dashboard_overview(token: str):
             "System Balance (K)": dashboard_data["total_balance"] / 1000
         }
         
-        fig = go.Figure(data=[
-            go.Bar(
-                x=list(health_metrics.keys()),
-                y=list(health_metrics.values()),
-                marker_color=['#1f77b4', '#ff7f0e', '#2ca02c']
-            )
-        ])
-        
-        fig.update_layout(
-            title="Key System Metrics",
-            yaxis_title="Value",
-            showlegend=False
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(build_health_bar(health_metrics), use_container_width=True)
 
 
-def user_management(token: str):
+def user_management(token: str, bootstrap: dict):
     """Display user management interface."""
     st.markdown("### 👥 User Management")
     
-    with st.spinner("Loading user data..."):
-        users_data = get_all_users(token)
-    
-    if not users_data:
-        st.error("❌ Failed to load user data.")
-        return
-    
-    users = users_data["users"]
+    first_page = bootstrap["users"]
+    total_users = first_page["total"]
+    page_size = first_page["page_size"]
     
-    if users:
-        # Convert to DataFrame for better display
-        df = pd.DataFrame(users)
-        
-        # Add cluster names
-        cluster_names = {
-            0: "Frugal Savers",
-            1: "Average Spenders", 
-            2: "High-Value Transactors",
-            3: "New/Infrequent Users"
-        }
-        
-        df['cluster_name'] = df['cluster_id'].map(cluster_names).fillna('Unassigned')
+    if total_users:
+        cluster_dist = bootstrap["dashboard"]["cluster_distribution"]
+        assigned_users = sum(cluster_dist.values())
         
         # Display summary
         st.markdown("#### 📋 User Summary")
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.metric("Total Users", len(df))
+            st.metric("Total Users", total_users)
         
         with col2:
-            assigned_users = df['cluster_id'].notna().sum()
             st.metric("Clustered Users", assigned_users)
         
         with col3:
-            unassigned_users = df['cluster_id'].isna().sum()
-            st.metric("Unassigned Users", unassigned_users)
+            st.metric("Unassigned Users", total_users - assigned_users)
         
         # User table
         st.markdown("#### 📊 User Details")
         
-        # Select columns to display
-        display_columns = ['username', 'full_name', 'email', 'cluster_name']
-        display_df = df[display_columns].copy()
-        display_df.columns = ['Username', 'Full Name', 'Email', 'Cluster']
+        n_pages = max(1, -(-total_users // page_size))
+        page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1)
+        
+        if page == 1:
+            users_data = first_page
+        else:
+            users_data = get_all_users(token, page, page_size)
+        
+        if not users_data:
+            st.error("❌ Failed to load user data.")
+            get_all_users.clear()
+            return
+        
+        users = users_data["users"]
+        display_df = pd.DataFrame({
+            'Username': [u['username'] for u in users],
+            'Full Name': [u['full_name'] for u in users],
+            'Email': [u['email'] for u in users],
+            'Cluster': [u['cluster_name'] or 'Unassigned' for u in users]
+        })
         
         st.dataframe(display_df, use_container_width=True)
+        st.caption(f"Page {page} of {n_pages} ({total_users} users)")
         
         # Cluster distribution
         st.markdown("#### 🎯 Cluster Distribution")
-        cluster_counts = df['cluster_name'].value_counts()
+        cluster_counts = Counter(cluster_dist)
+        if total_users > assigned_users:
+            cluster_counts['Unassigned'] = total_users - assigned_users
         
-        fig = px.bar(
-            x=cluster_counts.index,
-            y=cluster_counts.values,
-            title="Users per Cluster",
-            labels={'x': 'Cluster', 'y': 'Number of Users'}
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(build_cluster_bar(dict(cluster_counts.most_common())), use_container_width=True)
         
     else:
         st.info("No users found in the system.")
 
 
-def ml_management(token: str):
+def ml_management(token: str, bootstrap: dict):
     """Display ML model management interface."""
     st.markdown("### 🤖 ML Model Management")
     
@@ -317,6 +350,7 @@ def ml_management(token: str):
                     st.error(f"❌ Training failed: {result['error']}")
                 else:
                     st.success("✅ Clustering model trained successfully!")
+                    get_admin_bootstrap.clear()
                     st.json(result)
     
     with col2:
@@ -328,6 +362,7 @@ def ml_management(token: str):
                     st.error(f"❌ Training failed: {result['error']}")
                 else:
                     st.success("✅ Recommendation model trained successfully!")
+                    get_admin_bootstrap.clear()
                     st.json(result)
     
     st.markdown("""
@@ -340,26 +375,25 @@ def ml_management(token: str):
     
     st.markdown("### 📁 Model Status")
     
-    # Check for model files
-    import os
-    
-    model_status = []
-    
-    # Check clustering model
-    if os.path.exists("ml_models/cluster_model.joblib"):
-        model_status.append({"Model": "Customer Clustering", "Status": "✅ Trained", "File": "cluster_model.joblib"})
-    else:
-        model_status.append({"Model": "Customer Clustering", "Status": "❌ Not Trained", "File": "cluster_model.joblib"})
-    
-    # Check recommendation model
-    if os.path.exists("ml_models/product_index.faiss"):
-        model_status.append({"Model": "Product Recommendations", "Status": "✅ Trained", "File": "product_index.faiss"})
-    else:
-        model_status.append({"Model": "Product Recommendations", "Status": "❌ Not Trained", "File": "product_index.faiss"})
-    
-    # Check forecasting models
-    forecast_models = [f for f in os.listdir("ml_models") if f.startswith("forecast_user_") and f.endswith(".pkl")] if os.path.exists("ml_models") else []
-    model_status.append({"Model": "Forecasting Models", "Status": f"✅ {len(forecast_models)} Users", "File": f"{len(forecast_models)} files"})
+    status = bootstrap["model_status"]
+    
+    model_status = [
+        {
+            "Model": "Customer Clustering",
+            "Status": "✅ Trained" if status["clustering_trained"] else "❌ Not Trained",
+            "File": "cluster_model.joblib"
+        },
+        {
+            "Model": "Product Recommendations",
+            "Status": "✅ Trained" if status["recommendations_trained"] else "❌ Not Trained",
+            "File": "product_index.faiss"
+        },
+        {
+            "Model": "Forecasting Models",
+            "Status": f"✅ {status['forecast_models']} Users",
+            "File": f"{status['forecast_models']} files"
+        }
+    ]
     
     status_df = pd.DataFrame(model_status)
     st.dataframe(status_df, use_container_width=True)
@@ -390,17 +424,29 @@ def main():
         if st.button("🚪 Logout"):
             st.session_state.admin_authenticated = False
             st.session_state.admin_token = None
+            # Drop only this app's cached admin data; cache_data.clear() is process-wide
+            get_admin_bootstrap.clear()
+            get_all_users.clear()
             st.rerun()
     
     # Main content
     st.markdown('<h1 class="main-header">🏦 FinCoach Admin Dashboard</h1>', unsafe_allow_html=True)
     
+    # Fetch data for all pages in a single request
+    with st.spinner("Loading admin data..."):
+        bootstrap = fetch_debounced(get_admin_bootstrap, st.session_state.admin_token)
+    
+    if not bootstrap:
+        st.error("❌ Failed to load dashboard data.")
+        get_admin_bootstrap.clear()
+        return
+    
     if page == "📊 Dashboard":
-        dashboard_overview(st.session_state.admin_token)
+        dashboard_overview(bootstrap)
     elif page == "👥 User Management":
-        user_management(st.session_state.admin_token)
+        user_management(st.session_state.admin_token, bootstrap)
     elif page == "🤖 ML Models":
-        ml_management(st.session_state.admin_token)
+        ml_management(st.session_state.admin_token, bootstrap)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+"""
+Shared HTTP client for the Streamlit apps.
+"""
+import streamlit as st
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import time
+
+# Configuration
+API_BASE_URL = "http://localhost:8000"
+FETCH_DEBOUNCE_SECONDS = 0.3
+REQUEST_TIMEOUT = (3, 10)  # (connect, read) seconds
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter that applies a default timeout to every request."""
+    
+    def __init__(self, *args, timeout=REQUEST_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+    
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Get the shared HTTP session used for API calls."""
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    adapter = TimeoutHTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_debounced(fetch, token: str):
+    """Reuse the last payload if the same fetch ran within the debounce window."""
+    key = f"{fetch.__name__}:{token}"
+    timestamps = st.session_state.setdefault("last_fetch_ts", {})
+    payloads = st.session_state.setdefault("last_fetch_payload", {})
+    
+    now = time.monotonic()
+    if key in payloads and now - timestamps[key] < FETCH_DEBOUNCE_SECONDS:
+        return payloads[key]
+    
+    payload = fetch(token)
+    if payload:
+        timestamps[key] = now
+        payloads[key] = payload
+    return payload
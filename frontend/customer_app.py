@@ -3,14 +3,16 @@ Streamlit customer application for the Financial Assistant.
 """
 import streamlit as st
 import requests
-import pandas as pd
+from api_client import API_BASE_URL, get_session, fetch_debounced
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 import json
 
 # Configuration
-API_BASE_URL = "http://localhost:8000"
+CHAT_TIMEOUT = (3, 60)
+CACHE_TTL_SECONDS = 60
+FIGURE_CACHE_MAX_ENTRIES = 256  # Figure caches are shared by every session in the process
 
 # Page configuration
 st.set_page_config(
@@ -36,19 +38,6 @@ st.markdown("""
         border-radius: 0.5rem;
         border-left: 4px solid #1f77b4;
     }
-    .chat-message {
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-radius: 0.5rem;
-    }
-    .user-message {
-        background-color: #e3f2fd;
-        margin-left: 2rem;
-    }
-    .assistant-message {
-        background-color: #f5f5f5;
-        margin-right: 2rem;
-    }
     .product-card {
         border: 1px solid #ddd;
         border-radius: 0.5rem;
@@ -61,10 +50,10 @@ st.markdown("""
 
 
 def authenticate_user(username: str, password: str) -> dict:
-    """Authenticate user and get access token."""
+    """Authenticate user and get access token along with the dashboard context."""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/token",
+        response = get_session().post(
+            f"{API_BASE_URL}/token-with-context",
             data={"username": username, "password": password}
         )
         if response.status_code == 200:
@@ -76,11 +65,12 @@ def authenticate_user(username: str, password: str) -> dict:
         return None
 
 
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
 def get_user_context(token: str) -> dict:
-    """Get user context from API."""
+    """Get user dashboard context (without recommendations) from API."""
     try:
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(f"{API_BASE_URL}/api/users/me/context", headers=headers)
+        response = get_session().get(f"{API_BASE_URL}/api/users/me/context/summary", headers=headers)
         if response.status_code == 200:
             return response.json()
         else:
@@ -89,23 +79,40 @@ def get_user_context(token: str) -> dict:
         return None
 
 
-def send_chat_message(token: str, message: str) -> dict:
-    """Send chat message to AI assistant."""
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def get_recommendations(token: str) -> list:
+    """Get product recommendations from API."""
     try:
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.post(
-            f"{API_BASE_URL}/api/chat",
-            headers=headers,
-            json={"message": message}
-        )
+        response = get_session().get(f"{API_BASE_URL}/api/users/me/context/recommendations", headers=headers)
         if response.status_code == 200:
-            return response.json()
+            return response.json()["recommendations"]
         else:
             return None
     except requests.exceptions.RequestException:
         return None
 
 
+def send_chat_message_stream(token: str, message: str):
+    """Send chat message to AI assistant and yield the response as it streams in."""
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        with get_session().post(
+            f"{API_BASE_URL}/api/chat/stream",
+            headers=headers,
+            json={"message": message},
+            stream=True,
+            timeout=CHAT_TIMEOUT
+        ) as response:
+            if response.status_code != 200:
+                return
+            for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                if chunk:
+                    yield chunk
+    except requests.exceptions.RequestException:
+        return
+
+
 def login_page():
     """Display login page."""
     st.markdown('<h1 class="main-header">💰 FinCoach</h1>', unsafe_allow_html=True)
@@ -144,6 +151,7 @@ def login_page():
                 
                 if auth_result:
                     st.session_state.token = auth_result["access_token"]
+                    st.session_state.login_context = auth_result["context"]
                     st.session_state.authenticated = True
                     st.success("✅ Login successful!")
                     st.rerun()
@@ -151,12 +159,66 @@ def login_page():
                     st.error("❌ Invalid credentials. Please try again.")
 
 
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=FIGURE_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_spending_pie(category_spending: dict) -> go.Figure:
+    """Build the spending-by-category pie chart."""
+    fig = px.pie(
+        values=list(category_spending.values()),
+        names=list(category_spending.keys()),
+        title="Spending Distribution"
+    )
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    return fig
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=FIGURE_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_forecast_chart(dates: list, values: list) -> go.Figure:
+    """Build the balance forecast line chart."""
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=values,
+        mode='lines+markers',
+        name='Predicted Balance',
+        line=dict(color='#1f77b4', width=3)
+    ))
+    
+    fig.update_layout(
+        title="30-Day Balance Forecast",
+        xaxis_title="Date",
+        yaxis_title="Balance ($)",
+        hovermode='x unified'
+    )
+    return fig
+
+
+def get_dashboard_figures(context: dict) -> dict:
+    """Get the dashboard figures, rebuilding them only when the context has changed."""
+    ctx_hash = hash(json.dumps(context, sort_keys=True, default=str))
+    
+    if st.session_state.get("last_ctx_hash") != ctx_hash:
+        category_spending = context["category_spending"]
+        forecast = context["forecast"]
+        
+        figures = {}
+        if category_spending:
+            figures["spending"] = build_spending_pie(category_spending)
+        if forecast and "dates" in forecast and "values" in forecast:
+            figures["forecast"] = build_forecast_chart(forecast['dates'], forecast['values'])
+        
+        st.session_state.dashboard_figures = figures
+        st.session_state.last_ctx_hash = ctx_hash
+    
+    return st.session_state.dashboard_figures
+
+
 def dashboard_tab(context: dict):
     """Display user dashboard."""
     user = context["user"]
     cluster = context["cluster"]
     forecast = context["forecast"]
     transactions = context["transactions"]
+    figures = get_dashboard_figures(context)
     
     # Welcome message
     st.markdown(f"### 👋 Welcome back, {user['full_name']}!")
@@ -198,20 +260,8 @@ def dashboard_tab(context: dict):
     with col1:
         st.markdown("### 📊 Spending by Category")
         if transactions:
-            # Create spending by category chart
-            df = pd.DataFrame(transactions)
-            category_spending = df.groupby('category')['debit'].sum().reset_index()
-            category_spending = category_spending[category_spending['debit'] > 0]
-            
-            if not category_spending.empty:
-                fig = px.pie(
-                    category_spending, 
-                    values='debit', 
-                    names='category',
-                    title="Spending Distribution"
-                )
-                fig.update_traces(textposition='inside', textinfo='percent+label')
-                st.plotly_chart(fig, use_container_width=True)
+            if "spending" in figures:
+                st.plotly_chart(figures["spending"], use_container_width=True)
             else:
                 st.info("No spending data available")
         else:
@@ -219,30 +269,8 @@ def dashboard_tab(context: dict):
     
     with col2:
         st.markdown("### 📈 Balance Forecast")
-        if forecast and "dates" in forecast and "values" in forecast:
-            # Create forecast chart
-            forecast_df = pd.DataFrame({
-                'Date': pd.to_datetime(forecast['dates']),
-                'Predicted Balance': forecast['values']
-            })
-            
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=forecast_df['Date'],
-                y=forecast_df['Predicted Balance'],
-                mode='lines+markers',
-                name='Predicted Balance',
-                line=dict(color='#1f77b4', width=3)
-            ))
-            
-            fig.update_layout(
-                title="30-Day Balance Forecast",
-                xaxis_title="Date",
-                yaxis_title="Balance ($)",
-                hovermode='x unified'
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
+        if "forecast" in figures:
+            st.plotly_chart(figures["forecast"], use_container_width=True)
         else:
             st.info("Forecast data not available")
     
@@ -252,8 +280,9 @@ def dashboard_tab(context: dict):
         st.markdown(f"**Summary**: {forecast['summary']}")
 
 
+@st.fragment
 def chat_tab(token: str):
-    """Display chat interface."""
+    """Display chat interface, rerunning on its own without refreshing the other tabs."""
     st.markdown("### 💬 Chat with FinCoach")
     st.markdown("Ask me anything about your finances, budgeting, or financial planning!")
     
@@ -265,51 +294,57 @@ def chat_tab(token: str):
     chat_container = st.container()
     
     with chat_container:
-        for i, (user_msg, assistant_msg, timestamp) in enumerate(st.session_state.chat_history):
-            # User message
-            st.markdown(f"""
-            <div class="chat-message user-message">
-                <strong>You:</strong> {user_msg}
-                <br><small>{timestamp}</small>
-            </div>
-            """, unsafe_allow_html=True)
+        for user_msg, assistant_msg, timestamp in st.session_state.chat_history:
+            with st.chat_message("user"):
+                st.markdown(user_msg)
+                st.caption(timestamp)
             
-            # Assistant message
-            st.markdown(f"""
-            <div class="chat-message assistant-message">
-                <strong>FinCoach:</strong> {assistant_msg}
-            </div>
-            """, unsafe_allow_html=True)
+            with st.chat_message("assistant"):
+                st.markdown(assistant_msg)
     
     # Chat input
     with st.form("chat_form", clear_on_submit=True):
         user_input = st.text_area("Type your message:", height=100, placeholder="e.g., How can I improve my spending habits?")
         submitted = st.form_submit_button("💬 Send", type="primary")
+    
+    if submitted and user_input.strip():
+        message = user_input.strip()
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
         
-        if submitted and user_input.strip():
-            with st.spinner("FinCoach is thinking..."):
-                response = send_chat_message(token, user_input.strip())
-                
-                if response:
-                    # Add to chat history
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-                    st.session_state.chat_history.append((
-                        user_input.strip(),
-                        response["response"],
-                        timestamp
-                    ))
-                    st.rerun()
-                else:
-                    st.error("❌ Failed to get response from FinCoach. Please try again.")
+        # Append only the new turn below the existing history
+        with chat_container:
+            with st.chat_message("user"):
+                st.markdown(message)
+                st.caption(timestamp)
+            
+            with st.chat_message("assistant"):
+                response = st.write_stream(send_chat_message_stream(token, message))
+        
+        if response:
+            st.session_state.chat_history.append((message, response, timestamp))
+        else:
+            st.error("❌ Failed to get response from FinCoach. Please try again.")
 
 
-def products_tab(context: dict):
-    """Display recommended products."""
-    recommendations = context["recommendations"]
-    
+@st.fragment
+def products_tab(token: str):
+    """Display recommended products, fetching them only once the user asks for them."""
     st.markdown("### 🎁 Recommended Products")
     st.markdown("Based on your financial profile and spending patterns, here are some products that might interest you:")
     
+    if not st.session_state.get("show_recommendations"):
+        if not st.button("🔍 Show my recommendations", type="primary"):
+            return
+        st.session_state.show_recommendations = True
+    
+    with st.spinner("Finding products for you..."):
+        recommendations = get_recommendations(token)
+    
+    if recommendations is None:
+        st.error("❌ Failed to load recommendations. Please try again.")
+        get_recommendations.clear()
+        return
+    
     if recommendations:
         for product in recommendations:
             with st.container():
@@ -355,14 +390,18 @@ def main():
         login_page()
         return
     
-    # Get user context
-    with st.spinner("Loading your financial dashboard..."):
-        context = get_user_context(st.session_state.token)
+    # Get user context, reusing the one returned at login on the first render
+    context = st.session_state.pop("login_context", None)
+    if context is None:
+        with st.spinner("Loading your financial dashboard..."):
+            context = fetch_debounced(get_user_context, st.session_state.token)
     
     if not context:
-        st.error("❌ Failed to load user data. Please login again.")
-        st.session_state.authenticated = False
-        st.rerun()
+        st.error("❌ Failed to load user data. Please try again later or login again.")
+        get_user_context.clear()
+        if st.button("🔐 Back to Login"):
+            st.session_state.authenticated = False
+            st.rerun()
         return
     
     # Sidebar
@@ -379,8 +418,13 @@ def main():
         if st.button("🚪 Logout"):
             st.session_state.authenticated = False
             st.session_state.token = None
+            # Drop only this app's cached user data; cache_data.clear() is process-wide
+            get_user_context.clear()
+            get_recommendations.clear()
             if "chat_history" in st.session_state:
                 del st.session_state.chat_history
+            if "show_recommendations" in st.session_state:
+                del st.session_state.show_recommendations
             st.rerun()
     
     # Main content
@@ -396,7 +440,7 @@ def main():
         chat_tab(st.session_state.token)
     
     with tab3:
-        products_tab(context)
+        products_tab(st.session_state.token)
 
 
 if __name__ == "__main__":
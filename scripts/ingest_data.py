@@ -1,10 +1,13 @@
 """
 Data ingestion script to populate the database with sample data.
 """
+import functools
+import io
 import os
 import sys
 import pandas as pd
 from datetime import datetime
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 
 # Add parent directory to path
@@ -17,16 +20,19 @@ from src.core.security import hash_password
 
 def create_sample_users(db: Session):
     """Create sample users including admin and customers."""
+    # Sample customers share a password, so bcrypt each distinct one only once
+    hash_once = functools.lru_cache(maxsize=None)(hash_password)
     
     # Create admin user
-    admin_user = User(
-        username="admin",
-        email="admin@finassist.com",
-        hashed_password=hash_password("admin123"),
-        role="admin",
-        full_name="System Administrator"
-    )
-    db.add(admin_user)
+    users = [
+        {
+            "username": "admin",
+            "email": "admin@finassist.com",
+            "hashed_password": hash_password("admin123"),
+            "role": "admin",
+            "full_name": "System Administrator"
+        }
+    ]
     
     # Create sample customers
     customers = [
@@ -57,15 +63,15 @@ def create_sample_users(db: Session):
     ]
     
     for customer_data in customers:
-        customer = User(
-            username=customer_data["username"],
-            email=customer_data["email"],
-            hashed_password=hash_password(customer_data["password"]),
-            role="customer",
-            full_name=customer_data["full_name"]
-        )
-        db.add(customer)
+        users.append({
+            "username": customer_data["username"],
+            "email": customer_data["email"],
+            "hashed_password": hash_once(customer_data["password"]),
+            "role": "customer",
+            "full_name": customer_data["full_name"]
+        })
     
+    db.execute(insert(User), users)
     db.commit()
     print("✅ Sample users created")
 
@@ -95,14 +101,45 @@ def create_clusters(db: Session):
         }
     ]
     
-    for cluster_data in clusters:
-        cluster = Cluster(**cluster_data)
-        db.add(cluster)
-    
+    db.execute(insert(Cluster), clusters)
     db.commit()
     print("✅ Clusters created")
 
 
+# CSV exports whose file name does not match the owner's username
+FILENAME_TO_USERNAME = {
+    "James_Smith_25M.csv": "james_smith"
+}
+
+TRANSACTION_COLUMNS = ("user_id", "date", "category", "debit", "credit", "balance")
+CSV_CHUNK_SIZE = 100_000
+CSV_DTYPES = {"category": "category", "debit": "float64", "credit": "float64", "balance": "float64"}
+CSV_DATE_FORMAT = "%Y-%m-%d %H:%M:%S%z"
+
+
+def bulk_insert_transactions(db: Session, df: pd.DataFrame) -> int:
+    """Insert a frame of transactions in one batch, using COPY on PostgreSQL."""
+    # An empty executemany would insert a single all-defaults row
+    if df.empty:
+        return 0
+    
+    df = df.loc[:, list(TRANSACTION_COLUMNS)]
+    
+    if db.bind.dialect.name == "postgresql":
+        # Stream the frame through COPY, bypassing per-row INSERTs entirely
+        buf = io.StringIO()
+        df.to_csv(buf, sep='\t', header=False, index=False, na_rep='\\N')
+        buf.seek(0)
+        raw = db.connection().connection
+        with raw.cursor() as cur:
+            cur.copy_from(buf, Transaction.__tablename__, columns=TRANSACTION_COLUMNS, sep='\t')
+    else:
+        # Single executemany INSERT without building ORM objects
+        db.execute(insert(Transaction), df.to_dict("records"))
+    
+    return len(df)
+
+
 def ingest_transaction_data(db: Session):
     """Ingest transaction data from CSV files."""
     data_dir = "data/sample_transactions"
@@ -117,17 +154,15 @@ def ingest_transaction_data(db: Session):
     user_mapping = {user.username: user.id for user in users}
     
     # Process CSV files
-    csv_files = [f for f in os.listdir(data_dir) if f.endswith('.csv')]
+    with os.scandir(data_dir) as entries:
+        csv_entries = [entry for entry in entries if entry.is_file() and entry.name.endswith('.csv')]
     
-    for csv_file in csv_files:
-        file_path = os.path.join(data_dir, csv_file)
+    for entry in csv_entries:
+        csv_file = entry.name
+        file_path = entry.path
         
-        # Extract user identifier from filename
-        if csv_file == "James_Smith_25M.csv":
-            username = "james_smith"
-        else:
-            # For other files, extract from filename
-            username = csv_file.replace('.csv', '').lower().replace('_', '_')
+        # Extract user identifier from filename, e.g. Sarah_Johnson.csv -> sarah_johnson
+        username = FILENAME_TO_USERNAME.get(csv_file, csv_file[:-len('.csv')].lower())
         
         if username not in user_mapping:
             print(f"⚠️ No user found for {csv_file}, skipping...")
@@ -136,25 +171,29 @@ def ingest_transaction_data(db: Session):
         user_id = user_mapping[username]
         
         try:
-            # Read CSV
-            df = pd.read_csv(file_path)
-            
-            # Convert date column
-            df['date'] = pd.to_datetime(df['date'])
+            # Read CSV in chunks so memory stays bounded for large files
+            reader = pd.read_csv(
+                file_path,
+                chunksize=CSV_CHUNK_SIZE,
+                dtype=CSV_DTYPES,
+                parse_dates=['date'],
+                date_format=CSV_DATE_FORMAT,
+                engine='c'
+            )
             
-            # Insert transactions
+            # Insert transactions chunk by chunk, committing once per file
             transactions_added = 0
-            for _, row in df.iterrows():
-                transaction = Transaction(
-                    user_id=user_id,
-                    date=row['date'],
-                    category=row['category'],
-                    debit=float(row['debit']) if pd.notna(row['debit']) else 0.0,
-                    credit=float(row['credit']) if pd.notna(row['credit']) else 0.0,
-                    balance=float(row['balance'])
-                )
-                db.add(transaction)
-                transactions_added += 1
+            for chunk in reader:
+                # A header-only file still yields one empty chunk
+                if chunk.empty:
+                    continue
+                
+                # pandas leaves dates in any other format as strings, so infer them instead
+                if not pd.api.types.is_datetime64_any_dtype(chunk['date']):
+                    chunk['date'] = pd.to_datetime(chunk['date'])
+                chunk['user_id'] = user_id
+                chunk[['debit', 'credit']] = chunk[['debit', 'credit']].fillna(0.0)
+                transactions_added += bulk_insert_transactions(db, chunk)
             
             db.commit()
             print(f"✅ Processed {csv_file}: {transactions_added} transactions for user {username}")
@@ -249,10 +288,7 @@ def create_sample_products(db: Session):
         }
     ]
     
-    for product_data in products:
-        product = Product(**product_data)
-        db.add(product)
-    
+    db.execute(insert(Product), products)
     db.commit()
     print("✅ Sample products created")
 
@@ -3,13 +3,16 @@ Script to train all ML models.
 """
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.database.base import SessionLocal
-from src.database.models import User
+from src.database.models import User, Transaction
 from src.ml.clustering import CustomerClustering
 from src.ml.forecasting import BalanceForecasting
 from src.ml.recommendations import ProductRecommendation
@@ -31,18 +34,40 @@ def train_clustering_model(db: Session):
         print(f"   - Number of users: {result['n_users']}")
 
 
+def fit_user_forecast(user_id: int, transactions: pd.DataFrame):
+    """Fit one user's forecasting model, run in a worker process."""
+    forecasting_service = BalanceForecasting()
+    daily_balance = forecasting_service.build_daily_balance(transactions)
+    return forecasting_service.fit_forecast_model(user_id, daily_balance)
+
+
 def train_forecasting_models(db: Session):
     """Train forecasting models for all users."""
     print("🔄 Training forecasting models...")
     
-    forecasting_service = BalanceForecasting()
     users = db.query(User).filter(User.role == "customer").all()
     
+    # Load every customer's transactions in one query and split per user
+    txns = pd.read_sql(
+        select(Transaction.user_id, Transaction.date, Transaction.balance)
+        .where(Transaction.user_id.in_([user.id for user in users]))
+        .order_by(Transaction.user_id, Transaction.date),
+        db.connection(),
+        parse_dates=['date']
+    )
+    groups = dict(list(txns.groupby('user_id')))
+    
+    # Users are independent, so fit them in parallel
+    user_ids = [user.id for user in users if user.id in groups]
+    with ProcessPoolExecutor() as executor:
+        fitted = executor.map(fit_user_forecast, user_ids, [groups[user_id] for user_id in user_ids])
+        results = dict(zip(user_ids, fitted))
+    
     successful_models = 0
     failed_models = 0
     
     for user in users:
-        result = forecasting_service.train_forecast_model(user.id, db)
+        result = results.get(user.id, {"error": "Insufficient data for forecasting"})
         
         if "error" in result:
             print(f"⚠️ Forecasting model for user {user.username} failed: {result['error']}")
@@ -2,10 +2,54 @@
 Chat service for AI-powered financial assistance.
 """
 import os
-from typing import List, Dict, Any, Optional
+import re
+from typing import List, Dict, Any, Optional, AsyncIterator
 import google.generativeai as genai
 from ..database.models import ChatHistory
 
+# System prompt template, filled with the user's context and message
+SYSTEM_PROMPT_TEMPLATE = """You are 'FinCoach', an expert, friendly, and encouraging personal finance assistant. Your goal is to provide insightful, actionable advice based on the user's financial data. NEVER give financial advice that could be construed as professional investment or legal advice. Keep responses concise and clear.
+
+**User's Financial Context (DO NOT mention this context to the user directly, use it to inform your answers):**
+{context}
+
+---
+User: {user_message}
+FinCoach:"""
+
+# Fallback topics in priority order, each matched by substring like "forecasting" or "saved"
+FALLBACK_TOPIC_PATTERNS = {
+    "budget": re.compile(r"budget|spending|expense"),
+    "save": re.compile(r"save|saving"),
+    "invest": re.compile(r"invest"),
+    "debt": re.compile(r"debt|loan|credit"),
+    "forecast": re.compile(r"forecast|future|predict")
+}
+
+FALLBACK_RESPONSES = {
+    "budget": "As a {user_cluster}, I'd recommend tracking your expenses carefully. Consider using the 50/30/20 rule: 50% for needs, 30% for wants, and 20% for savings. Would you like specific budgeting tips for your spending pattern?",
+    "save": "Building an emergency fund is crucial! Start with saving $500-$1000 for unexpected expenses. Even small amounts saved regularly can make a big difference. What's your current savings goal?",
+    "invest": "Investment decisions should align with your risk tolerance and financial goals. Consider starting with low-cost index funds or speaking with a financial advisor. Remember, I can't provide specific investment advice, but I can help you understand general principles!",
+    "debt": "Managing debt effectively is key to financial health. Consider the debt avalanche method (paying off highest interest first) or debt snowball (smallest balance first). Would you like to discuss debt management strategies?",
+    "forecast": "Based on your spending patterns, I can help you understand potential future scenarios. Your financial forecast depends on maintaining current habits. Would you like tips on improving your financial trajectory?",
+    None: "Thanks for your question! As a {user_cluster}, you have unique financial patterns. I'm here to help with budgeting, saving, spending analysis, and general financial guidance. What specific area would you like to explore?"
+}
+
+# Appended when Gemini fails after part of a streamed response was sent
+STREAM_INTERRUPTED_MESSAGE = "\n\n⚠️ Sorry, my response was cut off. Please try asking again."
+
+# Gemini model shared by every ChatService in the process
+_gemini_model = None
+
+
+def get_gemini_model(api_key: str):
+    """Configure Gemini and create the model once per process."""
+    global _gemini_model
+    if _gemini_model is None:
+        genai.configure(api_key=api_key)
+        _gemini_model = genai.GenerativeModel('gemini-pro')
+    return _gemini_model
+
 
 class ChatService:
     """AI chat service using Google Gemini."""
@@ -21,8 +65,7 @@ class ChatService:
             return
         
         try:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-pro')
+            self.model = get_gemini_model(self.api_key)
             print("✅ Gemini AI initialized successfully")
         except Exception as e:
             print(f"⚠️ Failed to initialize Gemini AI: {e}")
@@ -38,26 +81,14 @@ class ChatService:
         chat_history: List[ChatHistory]
     ) -> str:
         """Generate AI response to user message."""
-        
-        # Build context
-        context = self._build_context(
-            user_cluster, cluster_description, forecast_summary, 
-            recommendations, chat_history
+        system_prompt = self._build_prompt(
+            user_message, user_cluster, cluster_description,
+            forecast_summary, recommendations, chat_history
         )
-        
-        # Create system prompt
-        system_prompt = f"""You are 'FinCoach', an expert, friendly, and encouraging personal finance assistant. Your goal is to provide insightful, actionable advice based on the user's financial data. NEVER give financial advice that could be construed as professional investment or legal advice. Keep responses concise and clear.
-
-**User's Financial Context (DO NOT mention this context to the user directly, use it to inform your answers):**
-{context}
-
----
-User: {user_message}
-FinCoach:"""
 
         if self.model:
             try:
-                response = self.model.generate_content(system_prompt)
+                response = await self.model.generate_content_async(system_prompt)
                 return response.text
             except Exception as e:
                 print(f"Gemini API error: {e}")
@@ -65,6 +96,55 @@ FinCoach:"""
         else:
             return self._get_fallback_response(user_message, user_cluster)
     
+    async def stream_response(
+        self,
+        user_message: str,
+        user_cluster: str,
+        cluster_description: str,
+        forecast_summary: str,
+        recommendations: List[Dict[str, Any]],
+        chat_history: List[ChatHistory]
+    ) -> AsyncIterator[str]:
+        """Stream AI response to user message as it is generated."""
+        system_prompt = self._build_prompt(
+            user_message, user_cluster, cluster_description,
+            forecast_summary, recommendations, chat_history
+        )
+        
+        streamed = False
+        if self.model:
+            try:
+                response = await self.model.generate_content_async(system_prompt, stream=True)
+                async for chunk in response:
+                    streamed = True
+                    yield chunk.text
+            except Exception as e:
+                print(f"Gemini API error: {e}")
+                if streamed:
+                    yield STREAM_INTERRUPTED_MESSAGE
+        
+        if not streamed:
+            yield self._get_fallback_response(user_message, user_cluster)
+    
+    def _build_prompt(
+        self,
+        user_message: str,
+        user_cluster: str,
+        cluster_description: str,
+        forecast_summary: str,
+        recommendations: List[Dict[str, Any]],
+        chat_history: List[ChatHistory]
+    ) -> str:
+        """Build the full system prompt for the AI."""
+        # Build context
+        context = self._build_context(
+            user_cluster, cluster_description, forecast_summary, 
+            recommendations, chat_history
+        )
+        
+        # Create system prompt
+        return SYSTEM_PROMPT_TEMPLATE.format(context=context, user_message=user_message)
+    
     def _build_context(
         self,
         user_cluster: str,
@@ -74,50 +154,33 @@ FinCoach:"""
         chat_history: List[ChatHistory]
     ) -> str:
         """Build context string for the AI."""
-        context_parts = []
-        
-        # Cluster information
-        context_parts.append(f"- **Behavioral Profile (Cluster):** {user_cluster} - {cluster_description}")
-        
-        # Forecast
-        context_parts.append(f"- **Spending Forecast:** {forecast_summary}")
+        # Cluster information and forecast
+        context_parts = [
+            f"- **Behavioral Profile (Cluster):** {user_cluster} - {cluster_description}",
+            f"- **Spending Forecast:** {forecast_summary}"
+        ]
         
         # Recommendations
         if recommendations:
-            rec_list = []
-            for rec in recommendations[:3]:
-                rec_list.append(f"{rec['name']} ({rec['category']})")
-            context_parts.append(f"- **Relevant Products for You:** {', '.join(rec_list)}")
+            rec_list = ", ".join(f"{rec['name']} ({rec['category']})" for rec in recommendations[:3])
+            context_parts.append(f"- **Relevant Products for You:** {rec_list}")
         
-        # Recent conversation
+        # Recent conversation, last 3 exchanges
         if chat_history:
-            history_parts = []
-            for chat in reversed(chat_history[-3:]):  # Last 3 exchanges
-                history_parts.append(f"User: {chat.user_message}")
-                history_parts.append(f"FinCoach: {chat.ai_response}")
-            context_parts.append(f"- **Recent Conversation:**\n{chr(10).join(history_parts)}")
+            history = "\n".join(
+                f"User: {chat.user_message}\nFinCoach: {chat.ai_response}"
+                for chat in chat_history[-1:-4:-1]
+            )
+            context_parts.append(f"- **Recent Conversation:**\n{history}")
         
         return "\n".join(context_parts)
     
     def _get_fallback_response(self, user_message: str, user_cluster: str) -> str:
         """Generate fallback response when AI is not available."""
+        # Simple keyword-based responses, first matching topic wins
         message_lower = user_message.lower()
-        
-        # Simple keyword-based responses
-        if any(word in message_lower for word in ['budget', 'spending', 'expense']):
-            return f"As a {user_cluster}, I'd recommend tracking your expenses carefully. Consider using the 50/30/20 rule: 50% for needs, 30% for wants, and 20% for savings. Would you like specific budgeting tips for your spending pattern?"
-        
-        elif any(word in message_lower for word in ['save', 'saving', 'savings']):
-            return "Building an emergency fund is crucial! Start with saving $500-$1000 for unexpected expenses. Even small amounts saved regularly can make a big difference. What's your current savings goal?"
-        
-        elif any(word in message_lower for word in ['invest', 'investment', 'investing']):
-            return "Investment decisions should align with your risk tolerance and financial goals. Consider starting with low-cost index funds or speaking with a financial advisor. Remember, I can't provide specific investment advice, but I can help you understand general principles!"
-        
-        elif any(word in message_lower for word in ['debt', 'loan', 'credit']):
-            return "Managing debt effectively is key to financial health. Consider the debt avalanche method (paying off highest interest first) or debt snowball (smallest balance first). Would you like to discuss debt management strategies?"
-        
-        elif any(word in message_lower for word in ['forecast', 'future', 'predict']):
-            return "Based on your spending patterns, I can help you understand potential future scenarios. Your financial forecast depends on maintaining current habits. Would you like tips on improving your financial trajectory?"
-        
-        else:
-            return f"Thanks for your question! As a {user_cluster}, you have unique financial patterns. I'm here to help with budgeting, saving, spending analysis, and general financial guidance. What specific area would you like to explore?"
\ No newline at end of file
+        topic = next(
+            (topic for topic, pattern in FALLBACK_TOPIC_PATTERNS.items() if pattern.search(message_lower)),
+            None
+        )
+        return FALLBACK_RESPONSES[topic].format(user_cluster=user_cluster)
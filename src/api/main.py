@@ -2,16 +2,22 @@
 FastAPI main application with all endpoints.
 """
 import os
-from datetime import timedelta
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from typing import List, Dict, Any
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import delete, func, select, update
 
-from ..database.base import get_db, create_tables
-from ..database.models import User, Transaction, Cluster, ChatHistory, Product
+from ..database.base import SessionLocal, get_db, create_tables
+from ..database.models import User, Transaction, Cluster, ChatHistory, Product, TrainingJob
 from ..core.security import (
     hash_password, verify_password, create_access_token, 
     get_current_user, require_admin, ACCESS_TOKEN_EXPIRE_MINUTES
@@ -22,44 +28,56 @@ from ..ml.recommendations import ProductRecommendation
 from .schemas import *
 from .chat_service import ChatService
 
-# Create tables on startup
-create_tables()
+# Pagination limits for admin user listings
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 
-# Initialize FastAPI app
-app = FastAPI(title="Financial Assistant API", version="1.0.0")
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Initialize ML services
+# Initialize ML services at import so preloaded workers share the loaded models
 clustering_service = CustomerClustering()
 forecasting_service = BalanceForecasting()
 recommendation_service = ProductRecommendation()
 chat_service = ChatService()
 
-# Load ML models at startup
-@app.on_event("startup")
-async def startup_event():
-    """Load ML models and initialize services."""
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create tables and initialize services once the server starts."""
+    create_tables()
+    
     try:
         # Initialize chat service
         await chat_service.initialize()
         print("✅ Chat service initialized")
     except Exception as e:
         print(f"⚠️ Chat service initialization failed: {e}")
+    
+    yield
+
+
+# Initialize FastAPI app
+app = FastAPI(
+    title="Financial Assistant API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+
+# Add CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 
 # Authentication endpoints
-@app.post("/token", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    """Authenticate user and return access token."""
-    user = db.query(User).filter(User.username == form_data.username).first()
+def _authenticate(form_data: OAuth2PasswordRequestForm, db: Session) -> User:
+    """Check login credentials and return the matching user."""
+    user = db.query(User).options(joinedload(User.cluster)).filter(
+        User.username == form_data.username
+    ).first()
     
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
@@ -67,7 +85,11 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+    return user
+
+
+def _issue_token(user: User) -> Dict[str, str]:
+    """Create a bearer token response for a user."""
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -76,6 +98,20 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@app.post("/token", response_model=Token)
+def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    """Authenticate user and return access token."""
+    user = _authenticate(form_data, db)
+    return _issue_token(user)
+
+
+@app.post("/token-with-context", response_model=TokenWithContext)
+def login_with_context(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    """Authenticate user and return access token together with the dashboard context."""
+    user = _authenticate(form_data, db)
+    return {**_issue_token(user), "context": _context_summary(user, db)}
+
+
 # Customer endpoints
 @app.get("/api/users/me", response_model=UserResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
@@ -83,89 +119,149 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
 
 
-@app.get("/api/users/me/context", response_model=UserContextResponse)
-async def get_user_context(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Get complete user context for dashboard."""
+def _context_summary(current_user: User, db: Session) -> Dict[str, Any]:
+    """Gather the dashboard context for a user, without recommendations."""
     # Get user cluster info
-    cluster = None
-    if current_user.cluster_id is not None:
-        cluster = db.query(Cluster).filter(Cluster.id == current_user.cluster_id).first()
+    cluster = current_user.cluster
     
     # Get recent transactions
     transactions = db.query(Transaction).filter(
         Transaction.user_id == current_user.id
     ).order_by(Transaction.date.desc()).limit(100).all()
     
+    # Total spending per category
+    category_totals = db.query(
+        Transaction.category, func.sum(Transaction.debit)
+    ).filter(
+        Transaction.user_id == current_user.id
+    ).group_by(Transaction.category).all()
+    
+    category_spending = {
+        category: round(total, 2) for category, total in category_totals if total and total > 0
+    }
+    
     # Generate forecast
     forecast = forecasting_service.generate_forecast(current_user.id, db)
     
-    # Get recommendations
+    return {
+        "user": current_user,
+        "cluster": cluster,
+        "transactions": TransactionListAdapter.validate_python(transactions),
+        "category_spending": category_spending,
+        "forecast": forecast
+    }
+
+
+def _user_recommendations(
+    current_user: User, cluster, forecast: Dict[str, Any], db: Session, top_k: int = 5
+) -> List[Dict[str, Any]]:
+    """Get product recommendations from a user's cluster and forecast."""
     cluster_name = cluster.name if cluster else "Unknown"
     forecast_summary = forecast.get("summary", "No forecast available")
-    recommendations = recommendation_service.get_recommendations(
-        current_user.id, cluster_name, forecast_summary, db
+    return recommendation_service.get_recommendations(
+        current_user.id, cluster_name, forecast_summary, db, top_k=top_k
+    )
+
+
+# Context endpoints are sync so FastAPI runs the ML calls in its threadpool
+@app.get("/api/users/me/context", response_model=UserContextResponse)
+def get_user_context(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get complete user context for dashboard."""
+    context = _context_summary(current_user, db)
+    context["recommendations"] = _user_recommendations(
+        current_user, context["cluster"], context["forecast"], db
     )
+    return context
+
+
+@app.get("/api/users/me/context/summary", response_model=UserSummaryResponse)
+def get_user_context_summary(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get user context for dashboard, without product recommendations."""
+    return _context_summary(current_user, db)
+
+
+@app.get("/api/users/me/context/recommendations", response_model=RecommendationListResponse)
+def get_user_recommendations(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get product recommendations for the current user."""
+    cluster = current_user.cluster
+    forecast = forecasting_service.generate_forecast(current_user.id, db)
+    return {"recommendations": _user_recommendations(current_user, cluster, forecast, db)}
+
+
+def _chat_context(current_user: User, db: Session) -> Dict[str, Any]:
+    """Gather the user context passed to the chat service."""
+    # Get user context
+    cluster = current_user.cluster
+    
+    # Get forecast
+    forecast = forecasting_service.generate_forecast(current_user.id, db)
+    
+    # Get recommendations
+    recommendations = _user_recommendations(current_user, cluster, forecast, db, top_k=3)
+    
+    # Get recent chat history
+    recent_chats = db.query(ChatHistory).filter(
+        ChatHistory.user_id == current_user.id
+    ).order_by(ChatHistory.timestamp.desc()).limit(5).all()
     
     return {
-        "user": current_user,
-        "cluster": cluster,
-        "transactions": transactions,
-        "forecast": forecast,
-        "recommendations": recommendations
+        "user_cluster": cluster.name if cluster else "Unknown",
+        "cluster_description": cluster.description if cluster else "",
+        "forecast_summary": forecast.get("summary", "No forecast available"),
+        "recommendations": recommendations,
+        "chat_history": recent_chats
     }
 
 
+def _persist_chat(user_id: int, user_message: str, ai_response: str, timestamp: datetime):
+    """Save a chat exchange to the user's history on its own session, after the response is sent."""
+    db = SessionLocal()
+    try:
+        db.add(ChatHistory(
+            user_id=user_id,
+            user_message=user_message,
+            ai_response=ai_response,
+            timestamp=timestamp
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat_with_assistant(
     message: ChatMessage,
+    background: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Chat with the AI financial assistant."""
     try:
-        # Get user context
-        cluster = None
-        if current_user.cluster_id is not None:
-            cluster = db.query(Cluster).filter(Cluster.id == current_user.cluster_id).first()
-        
-        # Get forecast
-        forecast = forecasting_service.generate_forecast(current_user.id, db)
-        
-        # Get recommendations
-        cluster_name = cluster.name if cluster else "Unknown"
-        forecast_summary = forecast.get("summary", "No forecast available")
-        recommendations = recommendation_service.get_recommendations(
-            current_user.id, cluster_name, forecast_summary, db, top_k=3
-        )
-        
-        # Get recent chat history
-        recent_chats = db.query(ChatHistory).filter(
-            ChatHistory.user_id == current_user.id
-        ).order_by(ChatHistory.timestamp.desc()).limit(5).all()
+        # Gather context off the event loop, forecasting and search are CPU-bound
+        context = await run_in_threadpool(_chat_context, current_user, db)
         
         # Generate AI response
         ai_response = await chat_service.generate_response(
             user_message=message.message,
-            user_cluster=cluster_name,
-            cluster_description=cluster.description if cluster else "",
-            forecast_summary=forecast_summary,
-            recommendations=recommendations,
-            chat_history=recent_chats
+            **context
         )
         
-        # Save chat history
-        chat_record = ChatHistory(
-            user_id=current_user.id,
-            user_message=message.message,
-            ai_response=ai_response
+        # Save chat history after the response has been sent
+        timestamp = datetime.utcnow()
+        background.add_task(
+            _persist_chat, current_user.id, message.message, ai_response, timestamp
         )
-        db.add(chat_record)
-        db.commit()
         
-        return ChatResponse(response=ai_response, timestamp=chat_record.timestamp)
+        return ChatResponse(response=ai_response, timestamp=timestamp)
         
     except Exception as e:
         raise HTTPException(
@@ -174,16 +270,58 @@ async def chat_with_assistant(
         )
 
 
-# Admin endpoints
-@app.get("/api/admin/dashboard", response_model=AdminDashboardResponse)
-async def get_admin_dashboard(
-    admin_user: User = Depends(require_admin),
+@app.post("/api/chat/stream")
+async def chat_with_assistant_stream(
+    message: ChatMessage,
+    current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get admin dashboard data."""
-    # Get statistics
-    total_users = db.query(User).filter(User.role == "customer").count()
-    total_transactions = db.query(Transaction).count()
+    """Chat with the AI financial assistant, streaming the response as plain text."""
+    try:
+        context = await run_in_threadpool(_chat_context, current_user, db)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Chat service error: {str(e)}"
+        )
+    
+    async def stream():
+        chunks = []
+        async for chunk in chat_service.stream_response(
+            user_message=message.message, **context
+        ):
+            chunks.append(chunk)
+            yield chunk
+        
+        # Save chat history once the full response has been sent
+        await run_in_threadpool(
+            _persist_chat, current_user.id, message.message, "".join(chunks), datetime.utcnow()
+        )
+    
+    return StreamingResponse(stream(), media_type="text/plain")
+
+
+# Admin endpoints, sync so FastAPI runs their queries and training in its threadpool
+def _dashboard_stats(db: Session) -> Dict[str, Any]:
+    """Compute system-wide statistics for the admin dashboard."""
+    # Latest balance per user, ranked by most recent transaction
+    ranked_balances = select(
+        Transaction.balance,
+        func.row_number().over(
+            partition_by=Transaction.user_id,
+            order_by=(Transaction.date.desc(), Transaction.id.desc())
+        ).label("rank")
+    ).subquery()
+    
+    # Get all scalar statistics in a single round-trip
+    stats = db.execute(select(
+        select(func.count(User.id)).where(User.role == "customer").scalar_subquery().label("total_users"),
+        select(func.count(Transaction.id)).scalar_subquery().label("total_transactions"),
+        select(func.avg(Transaction.debit)).scalar_subquery().label("avg_transaction"),
+        select(func.sum(ranked_balances.c.balance)).where(
+            ranked_balances.c.rank == 1
+        ).scalar_subquery().label("total_balance")
+    )).one()
     
     # Cluster distribution
     cluster_dist = db.query(
@@ -192,66 +330,218 @@ async def get_admin_dashboard(
     
     cluster_distribution = {name: count for name, count in cluster_dist}
     
-    # Average transaction value
-    avg_transaction = db.query(func.avg(Transaction.debit)).scalar() or 0
+    return {
+        "total_users": stats.total_users,
+        "total_transactions": stats.total_transactions,
+        "cluster_distribution": cluster_distribution,
+        "avg_transaction_value": round(stats.avg_transaction or 0, 2),
+        "total_balance": round(stats.total_balance or 0, 2)
+    }
+
+
+def _list_customers(db: Session, page: int, page_size: int) -> Dict[str, Any]:
+    """Get one page of customers with their cluster names joined in."""
+    customers = db.query(User).filter(User.role == "customer")
+    rows = db.query(
+        User.id, User.username, User.email, User.full_name, User.role,
+        User.cluster_id, Cluster.name.label("cluster_name")
+    ).outerjoin(
+        Cluster, Cluster.id == User.cluster_id
+    ).filter(
+        User.role == "customer"
+    ).order_by(User.id).offset((page - 1) * page_size).limit(page_size).all()
     
-    # Total balance (sum of latest balance for each user)
-    latest_balances = db.query(
-        Transaction.user_id,
-        func.max(Transaction.balance).label('latest_balance')
-    ).group_by(Transaction.user_id).subquery()
+    return {
+        "users": [row._asdict() for row in rows],
+        "total": customers.count(),
+        "page": page,
+        "page_size": page_size
+    }
+
+
+MODEL_STATUS_TTL_SECONDS = 30
+_model_status_cache: Dict[str, Any] = {"value": None, "expires": 0.0}
+
+
+def _model_status() -> Dict[str, Any]:
+    """Report which ML model artifacts are present on disk."""
+    if _model_status_cache["value"] is not None and time.monotonic() < _model_status_cache["expires"]:
+        return _model_status_cache["value"]
     
-    total_balance = db.query(func.sum(latest_balances.c.latest_balance)).scalar() or 0
+    forecast_models = [
+        f for f in os.listdir("ml_models")
+        if f.startswith("forecast_user_") and f.endswith(".pkl")
+    ] if os.path.exists("ml_models") else []
     
-    return {
-        "total_users": total_users,
-        "total_transactions": total_transactions,
-        "cluster_distribution": cluster_distribution,
-        "avg_transaction_value": round(avg_transaction, 2),
-        "total_balance": round(total_balance, 2)
+    _model_status_cache["value"] = {
+        "clustering_trained": os.path.exists("ml_models/cluster_model.joblib"),
+        "recommendations_trained": os.path.exists("ml_models/product_index.faiss"),
+        "forecast_models": len(forecast_models)
     }
+    _model_status_cache["expires"] = time.monotonic() + MODEL_STATUS_TTL_SECONDS
+    return _model_status_cache["value"]
+
+
+def _clear_model_status():
+    """Invalidate the cached model status after a model has been trained."""
+    _model_status_cache["value"] = None
+
+
+@app.get("/api/admin/dashboard", response_model=AdminDashboardResponse)
+def get_admin_dashboard(
+    admin_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """Get admin dashboard data."""
+    return _dashboard_stats(db)
 
 
 @app.get("/api/admin/users", response_model=UserListResponse)
-async def get_all_users(
+def get_all_users(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    admin_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """Get a page of users for admin view."""
+    return _list_customers(db, page, page_size)
+
+
+@app.get("/api/admin/bootstrap", response_model=AdminBootstrapResponse)
+def get_admin_bootstrap(
     admin_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
-    """Get all users for admin view."""
-    users = db.query(User).filter(User.role == "customer").all()
-    return {"users": users}
+    """Get dashboard stats, the first page of users and model status in a single round trip."""
+    return {
+        "dashboard": _dashboard_stats(db),
+        "users": _list_customers(db, 1, DEFAULT_PAGE_SIZE),
+        "model_status": _model_status()
+    }
+
+
+# ML training endpoints (admin only), run as background jobs so requests return at once.
+# Jobs live in the database so every worker can report them.
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
+# Jobs older than this are dropped, whether finished or abandoned by a crashed worker
+TRAINING_JOB_TTL = timedelta(hours=1)
+
+# Makes the check for a running job and the insert of a new one atomic within a worker
+_enqueue_lock = threading.Lock()
+
+
+def _job_response(job: TrainingJob) -> Dict[str, Any]:
+    """Describe a training job for the API."""
+    return {"job_id": job.id, "status": job.status, "result": job.result}
+
+
+def _run_training_job(job_id: str, train):
+    """Run a training function on its own session and record the outcome."""
+    db = SessionLocal()
+    try:
+        db.execute(update(TrainingJob).where(TrainingJob.id == job_id).values(status="running"))
+        db.commit()
+        
+        try:
+            result = train(db)
+            job_status = "failed" if "error" in result else "completed"
+        except Exception as e:
+            db.rollback()
+            result, job_status = {"error": str(e)}, "failed"
+        
+        db.execute(
+            update(TrainingJob).where(TrainingJob.id == job_id)
+            .values(status=job_status, result=result, finished_at=datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+        _clear_model_status()
+
+
+def _enqueue_training_job(background: BackgroundTasks, kind: str, train, db: Session) -> Dict[str, Any]:
+    """Queue a training function unless a job of the same kind is already active."""
+    now = datetime.utcnow()
+    with _enqueue_lock:
+        db.execute(delete(TrainingJob).where(TrainingJob.created_at < now - TRAINING_JOB_TTL))
+        active = db.query(TrainingJob.id).filter(
+            TrainingJob.kind == kind, TrainingJob.status.in_(ACTIVE_JOB_STATUSES)
+        ).first()
+        if active is not None:
+            db.commit()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"A {kind} training job is already running"
+            )
+        
+        job = TrainingJob(id=uuid.uuid4().hex, kind=kind, status="queued", created_at=now)
+        db.add(job)
+        db.commit()
+    
+    background.add_task(_run_training_job, job.id, train)
+    return _job_response(job)
 
 
-# ML training endpoints (admin only)
-@app.post("/api/admin/train-clustering")
-async def train_clustering_model(
+@app.post(
+    "/api/admin/train-clustering",
+    response_model=TrainingJobResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+def train_clustering_model(
+    background: BackgroundTasks,
     admin_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
-    """Train the customer clustering model."""
-    result = clustering_service.train_cluster_model(db)
-    return result
+    """Queue training of the customer clustering model."""
+    return _enqueue_training_job(background, "clustering", clustering_service.train_cluster_model, db)
 
 
-@app.post("/api/admin/train-recommendations")
-async def train_recommendation_model(
+@app.post(
+    "/api/admin/train-recommendations",
+    response_model=TrainingJobResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+def train_recommendation_model(
+    background: BackgroundTasks,
     admin_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
-    """Build product recommendation embeddings."""
-    result = recommendation_service.build_product_embeddings(db)
-    return result
+    """Queue building of the product recommendation embeddings."""
+    return _enqueue_training_job(
+        background, "recommendations", recommendation_service.build_product_embeddings, db
+    )
 
 
-@app.post("/api/admin/train-forecasting/{user_id}")
-async def train_forecasting_model(
+@app.post(
+    "/api/admin/train-forecasting/{user_id}",
+    response_model=TrainingJobResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+def train_forecasting_model(
     user_id: int,
+    background: BackgroundTasks,
+    admin_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """Queue training of the forecasting model for a specific user."""
+    return _enqueue_training_job(
+        background, f"forecasting:{user_id}",
+        lambda job_db: forecasting_service.train_forecast_model(user_id, job_db), db
+    )
+
+
+@app.get("/api/admin/jobs/{job_id}", response_model=TrainingJobResponse)
+def get_training_job(
+    job_id: str,
     admin_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
-    """Train forecasting model for a specific user."""
-    result = forecasting_service.train_forecast_model(user_id, db)
-    return result
+    """Get the status and result of a training job."""
+    job = db.get(TrainingJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
 
 
 # Health check
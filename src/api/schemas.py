@@ -1,7 +1,7 @@
 """
 Pydantic schemas for API request/response models.
 """
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
@@ -22,8 +22,7 @@ class UserResponse(BaseModel):
     role: str
     cluster_id: Optional[int]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class Token(BaseModel):
@@ -53,8 +52,11 @@ class TransactionResponse(BaseModel):
     balance: float
     description: Optional[str]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+# Validates a whole list of ORM transactions in one call
+TransactionListAdapter = TypeAdapter(List[TransactionResponse])
 
 
 class ClusterResponse(BaseModel):
@@ -62,8 +64,7 @@ class ClusterResponse(BaseModel):
     name: str
     description: Optional[str]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ProductResponse(BaseModel):
@@ -77,15 +78,26 @@ class ProductResponse(BaseModel):
     min_balance: Optional[float]
     relevance_score: Optional[float] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
-class UserContextResponse(BaseModel):
+class UserSummaryResponse(BaseModel):
     user: UserResponse
     cluster: Optional[ClusterResponse]
     transactions: List[TransactionResponse]
+    category_spending: Dict[str, float]
     forecast: Dict[str, Any]
+
+
+class TokenWithContext(Token):
+    context: UserSummaryResponse
+
+
+class UserContextResponse(UserSummaryResponse):
+    recommendations: List[ProductResponse]
+
+
+class RecommendationListResponse(BaseModel):
     recommendations: List[ProductResponse]
 
 
@@ -97,5 +109,32 @@ class AdminDashboardResponse(BaseModel):
     total_balance: float
 
 
+class AdminUserResponse(UserResponse):
+    cluster_name: Optional[str] = None
+
+
 class UserListResponse(BaseModel):
-    users: List[UserResponse]
\ No newline at end of file
+    users: List[AdminUserResponse]
+    total: int
+    page: int
+    page_size: int
+
+
+class ModelStatusResponse(BaseModel):
+    clustering_trained: bool
+    recommendations_trained: bool
+    forecast_models: int
+
+
+class AdminBootstrapResponse(BaseModel):
+    dashboard: AdminDashboardResponse
+    users: UserListResponse
+    model_status: ModelStatusResponse
+    
+    model_config = ConfigDict(protected_namespaces=())
+
+
+class TrainingJobResponse(BaseModel):
+    job_id: str
+    status: str
+    result: Optional[Dict[str, Any]] = None
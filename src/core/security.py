@@ -7,7 +7,7 @@ from typing import Optional
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from ..database.base import get_db
 from ..database.models import User
 
@@ -58,7 +58,10 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == username).first()
+    # Load the user's cluster in the same round-trip, most endpoints need it
+    user = db.query(User).options(joinedload(User.cluster)).filter(
+        User.username == username
+    ).first()
     if user is None:
         raise credentials_exception
     return user
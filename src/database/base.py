@@ -2,15 +2,50 @@
 Database connection and session management.
 """
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from .models import Base
 
 # Database configuration
 DATABASE_URL = "sqlite:///./financial_assistant.db"
 
+# Batch executemany INSERTs into multi-row VALUES statements and keep a
+# bounded pool of reusable connections
+engine_kwargs = {
+    "insertmanyvalues_page_size": 5000,
+    "poolclass": QueuePool,
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True
+}
+if DATABASE_URL.startswith("sqlite"):
+    engine_kwargs["connect_args"] = {"check_same_thread": False, "timeout": 30}
+elif DATABASE_URL.startswith("postgresql"):
+    engine_kwargs["executemany_mode"] = "values_plus_batch"
+
 # Create engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(DATABASE_URL, **engine_kwargs)
+
+# SQLite tuning, applied to every new connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # readers no longer block on writers
+    "PRAGMA synchronous=NORMAL",  # fsync at checkpoints rather than every commit
+    "PRAGMA cache_size=-65536",  # 64 MiB page cache
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456"  # 256 MiB
+)
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Apply SQLite performance pragmas to a new connection."""
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -1,7 +1,7 @@
 """
 Database models for the Financial Assistant platform.
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, Index, JSON, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -31,6 +31,10 @@ class User(Base):
 class Transaction(Base):
     """Transaction model for financial data."""
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Recent transactions per user; also serves per-user grouping
+        Index("ix_txn_user_date", "user_id", text("date DESC")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -60,6 +64,9 @@ class Cluster(Base):
 class ChatHistory(Base):
     """Chat history model for conversation tracking."""
     __tablename__ = "chat_history"
+    __table_args__ = (
+        Index("ix_chat_user_ts", "user_id", text("timestamp DESC")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -83,4 +90,19 @@ class Product(Base):
     interest_rate = Column(Float, nullable=True)
     fees = Column(Float, nullable=True)
     min_balance = Column(Float, nullable=True)
-    target_cluster = Column(String(50), nullable=True)
\ No newline at end of file
+    target_cluster = Column(String(50), nullable=True)
+
+
+class TrainingJob(Base):
+    """Background model training job, shared by every API worker."""
+    __tablename__ = "training_jobs"
+    __table_args__ = (
+        Index("ix_job_kind_status", "kind", "status"),
+    )
+    
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(50), nullable=False)  # 'clustering', 'recommendations' or 'forecasting:<user_id>'
+    status = Column(String(20), nullable=False, default="queued")  # 'queued', 'running', 'completed' or 'failed'
+    result = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -3,22 +3,28 @@ Customer clustering using machine learning.
 """
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import silhouette_score
 import joblib
 import os
 from typing import Dict, List, Tuple
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
 from ..database.models import User, Transaction, Cluster
 
+# Users per minibatch when fitting the cluster centers
+CLUSTER_BATCH_SIZE = 256
+
+# Common categories used for the spending profile
+SPENDING_CATEGORIES = ['Market', 'Transport', 'Coffe', 'Restuarant', 'Phone', 'Health', 'Learning']
+
 
 class CustomerClustering:
     """Customer clustering for behavioral segmentation."""
     
     def __init__(self):
-        self.scaler = StandardScaler()
-        self.kmeans = KMeans(n_clusters=4, random_state=42)
+        self.scaler, self.kmeans = self._new_models()
         self.cluster_names = {
             0: "Frugal Savers",
             1: "Average Spenders", 
@@ -32,70 +38,83 @@ class CustomerClustering:
             3: "New customers or infrequent users with limited transaction history."
         }
     
+    @staticmethod
+    def _new_models() -> Tuple[StandardScaler, MiniBatchKMeans]:
+        """Create an unfitted scaler and cluster model."""
+        return StandardScaler(), MiniBatchKMeans(
+            n_clusters=4, batch_size=CLUSTER_BATCH_SIZE, n_init="auto", random_state=42
+        )
+    
+    @classmethod
+    def _fit_models(cls, X: np.ndarray) -> Tuple[StandardScaler, MiniBatchKMeans]:
+        """Fit a new scaler and cluster model; MiniBatchKMeans iterates its minibatches to convergence."""
+        scaler, kmeans = cls._new_models()
+        kmeans.fit(scaler.fit_transform(X))
+        return scaler, kmeans
+    
     def extract_features(self, user_id: int, db: Session) -> Dict[str, float]:
         """Extract RFM and behavioral features for a user."""
-        transactions = db.query(Transaction).filter(Transaction.user_id == user_id).all()
-        
-        if not transactions:
-            return self._default_features()
+        return self.extract_features_bulk(db, User.id == user_id).loc[user_id].to_dict()
+    
+    def extract_features_bulk(self, db: Session, *criteria) -> pd.DataFrame:
+        """Extract RFM and behavioral features for the users matching criteria, one row per user."""
+        # Filter users in SQL; an id list could exceed the database's bind parameter limit
+        user_ids = [user_id for user_id, in db.query(User.id).filter(*criteria).order_by(User.id)]
+        df = pd.read_sql(
+            db.query(
+                Transaction.user_id, Transaction.date, Transaction.category,
+                Transaction.debit, Transaction.balance
+            ).join(User, Transaction.user_id == User.id).filter(*criteria).statement,
+            db.connection(),
+            parse_dates=['date']
+        )
         
-        df = pd.DataFrame([{
-            'date': t.date,
-            'category': t.category,
-            'debit': t.debit,
-            'credit': t.credit,
-            'balance': t.balance
-        } for t in transactions])
+        # Users without transactions keep the default features
+        features = pd.DataFrame(
+            [self._default_features()] * len(user_ids),
+            index=pd.Index(user_ids, name='user_id'),
+            dtype=float
+        )
+        if df.empty:
+            return features
         
-        df['date'] = pd.to_datetime(df['date'])
+        g = df.groupby('user_id')
         
         # RFM Features
-        recency = (pd.Timestamp.now() - df['date'].max()).days
-        frequency = len(df)
-        monetary = df['debit'].sum()
+        recency = (pd.Timestamp.now() - g['date'].max()).dt.days
+        frequency = g.size()
+        monetary = g['debit'].sum()
         
         # Spending Profile (normalized spending per category)
-        category_spending = df.groupby('category')['debit'].sum()
-        total_spending = category_spending.sum()
-        
-        # Common categories
-        categories = ['Market', 'Transport', 'Coffe', 'Restuarant', 'Phone', 'Health', 'Learning']
-        spending_profile = {}
-        for cat in categories:
-            spending_profile[f'spending_{cat.lower()}'] = (
-                category_spending.get(cat, 0) / total_spending if total_spending > 0 else 0
-            )
+        category_spending = df.pivot_table(
+            index='user_id', columns='category', values='debit', aggfunc='sum', fill_value=0
+        ).reindex(columns=SPENDING_CATEGORIES, fill_value=0)
+        spending_profile = category_spending.div(monetary.where(monetary > 0), axis=0).fillna(0)
+        spending_profile.columns = [f'spending_{cat.lower()}' for cat in SPENDING_CATEGORIES]
         
         # Behavioral ratios
-        df['weekday'] = df['date'].dt.weekday
-        weekday_spending = df[df['weekday'] < 5]['debit'].sum()
-        weekend_spending = df[df['weekday'] >= 5]['debit'].sum()
-        weekday_ratio = (
-            weekday_spending / (weekday_spending + weekend_spending) 
-            if (weekday_spending + weekend_spending) > 0 else 0.5
-        )
-        
-        # Average transaction amount
-        avg_transaction = df['debit'].mean() if len(df) > 0 else 0
-        
-        # Balance volatility
-        balance_std = df['balance'].std() if len(df) > 1 else 0
-        
-        features = {
-            'recency': recency,
-            'frequency': frequency,
-            'monetary': monetary,
-            'avg_transaction': avg_transaction,
-            'balance_std': balance_std,
-            'weekday_ratio': weekday_ratio,
-            **spending_profile
-        }
-        
+        weekday_spending = df['debit'].where(df['date'].dt.weekday < 5).groupby(df['user_id']).sum()
+        weekday_ratio = (weekday_spending / monetary.where(monetary > 0)).fillna(0.5)
+        
+        # Average transaction amount and balance volatility
+        avg_transaction = g['debit'].mean().fillna(0)
+        balance_std = g['balance'].std().fillna(0)
+        
+        observed = pd.concat([
+            recency.rename('recency'),
+            frequency.rename('frequency'),
+            monetary.rename('monetary'),
+            avg_transaction.rename('avg_transaction'),
+            balance_std.rename('balance_std'),
+            weekday_ratio.rename('weekday_ratio'),
+            spending_profile
+        ], axis=1)
+        
+        features.update(observed)
         return features
     
     def _default_features(self) -> Dict[str, float]:
         """Return default features for users with no transactions."""
-        categories = ['Market', 'Transport', 'Coffe', 'Restuarant', 'Phone', 'Health', 'Learning']
         features = {
             'recency': 365,
             'frequency': 0,
@@ -104,42 +123,35 @@ class CustomerClustering:
             'balance_std': 0,
             'weekday_ratio': 0.5
         }
-        for cat in categories:
+        for cat in SPENDING_CATEGORIES:
             features[f'spending_{cat.lower()}'] = 0
         return features
     
     def train_cluster_model(self, db: Session) -> Dict[str, float]:
         """Train the clustering model on all users."""
-        users = db.query(User).filter(User.role == "customer").all()
-        
-        # Extract features for all users
-        features_list = []
-        user_ids = []
+        # Extract features for all customers in one pass
+        features = self.extract_features_bulk(db, User.role == "customer")
+        user_ids = features.index.tolist()
         
-        for user in users:
-            features = self.extract_features(user.id, db)
-            features_list.append(list(features.values()))
-            user_ids.append(user.id)
-        
-        if not features_list:
+        if not user_ids:
             return {"error": "No customer data available"}
         
-        # Convert to numpy array and scale
-        X = np.array(features_list)
-        X_scaled = self.scaler.fit_transform(X)
-        
-        # Fit KMeans
-        cluster_labels = self.kmeans.fit_predict(X_scaled)
+        # Convert to numpy array and fit fresh models on it
+        X = features.to_numpy(dtype=float)
+        scaler, kmeans = self._fit_models(X)
+        X_scaled = scaler.transform(X)
+        cluster_labels = kmeans.predict(X_scaled)
         
         # Calculate silhouette score
         silhouette_avg = silhouette_score(X_scaled, cluster_labels)
         
-        # Save models
+        # Swap in and save the new models
+        self.scaler, self.kmeans = scaler, kmeans
         os.makedirs("ml_models", exist_ok=True)
         joblib.dump({
             'scaler': self.scaler,
             'kmeans': self.kmeans,
-            'feature_names': list(self.extract_features(user_ids[0], db).keys())
+            'feature_names': list(features.columns)
         }, "ml_models/cluster_model.joblib")
         
         # Update user clusters in database
@@ -154,21 +166,21 @@ class CustomerClustering:
     def _update_user_clusters(self, db: Session, user_ids: List[int], cluster_labels: List[int]):
         """Update user cluster assignments in database."""
         # Create cluster records if they don't exist
-        for cluster_id, name in self.cluster_names.items():
-            existing_cluster = db.query(Cluster).filter(Cluster.id == cluster_id).first()
-            if not existing_cluster:
-                cluster = Cluster(
-                    id=cluster_id,
-                    name=name,
-                    description=self.cluster_descriptions[cluster_id]
-                )
-                db.add(cluster)
-        
-        # Update user cluster assignments
-        for user_id, cluster_label in zip(user_ids, cluster_labels):
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                user.cluster_id = cluster_label
+        existing = {
+            cluster_id for cluster_id, in db.query(Cluster.id).filter(Cluster.id.in_(self.cluster_names))
+        }
+        missing = [
+            {"id": cluster_id, "name": name, "description": self.cluster_descriptions[cluster_id]}
+            for cluster_id, name in self.cluster_names.items() if cluster_id not in existing
+        ]
+        if missing:
+            db.execute(insert(Cluster), missing)
+        
+        # Update user cluster assignments in one executemany by primary key
+        db.execute(update(User), [
+            {"id": user_id, "cluster_id": int(cluster_label)}
+            for user_id, cluster_label in zip(user_ids, cluster_labels)
+        ])
         
         db.commit()
     
@@ -3,74 +3,80 @@ Balance forecasting using time series analysis.
 """
 import pandas as pd
 import numpy as np
-from darts import TimeSeries
-from darts.models import ExponentialSmoothing
+from statsmodels.tsa.holtwinters import ExponentialSmoothing
 import pickle
 import os
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from ..database.models import Transaction
 from datetime import datetime, timedelta
 
 
+@lru_cache(maxsize=1024)
+def _load_forecast_model(path: str, mtime_ns: int):
+    """Unpickle a forecast model, cached until the file is rewritten."""
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+# Additive Holt-Winters with weekly seasonality on the daily balance
+SEASONAL_PERIODS = 7
+
+# Transaction rows fetched per partition when building a user's time series
+TIME_SERIES_PARTITION_ROWS = 10_000
+
+
 class BalanceForecasting:
     """Balance forecasting for financial planning."""
     
-    def __init__(self):
-        self.model = ExponentialSmoothing()
-    
     def prepare_time_series(self, user_id: int, db: Session) -> Optional[pd.DataFrame]:
         """Prepare daily balance time series for a user."""
-        transactions = db.query(Transaction).filter(
-            Transaction.user_id == user_id
-        ).order_by(Transaction.date).all()
-        
-        if not transactions:
-            return None
-        
-        # Convert to DataFrame
-        df = pd.DataFrame([{
-            'date': t.date.date(),
-            'balance': t.balance
-        } for t in transactions])
-        
-        # Group by date and take the last balance of each day
-        daily_balance = df.groupby('date')['balance'].last().reset_index()
-        daily_balance['date'] = pd.to_datetime(daily_balance['date'])
-        daily_balance = daily_balance.set_index('date')
+        # Stream plain (date, balance) rows instead of building ORM objects
+        result = db.execute(
+            select(Transaction.date, Transaction.balance)
+            .where(Transaction.user_id == user_id)
+            .order_by(Transaction.date)
+        ).yield_per(TIME_SERIES_PARTITION_ROWS)
         
-        # Create complete date range and forward fill missing values
-        start_date = daily_balance.index.min()
-        end_date = daily_balance.index.max()
-        date_range = pd.date_range(start=start_date, end=end_date, freq='D')
+        frames = [pd.DataFrame(rows, columns=['date', 'balance']) for rows in result.partitions()]
         
-        daily_balance = daily_balance.reindex(date_range)
-        daily_balance['balance'] = daily_balance['balance'].fillna(method='ffill')
+        if not frames:
+            return None
         
-        return daily_balance
+        transactions = pd.concat(frames, ignore_index=True)
+        transactions['date'] = pd.to_datetime(transactions['date'])
+        return self.build_daily_balance(transactions)
+    
+    def build_daily_balance(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """Build a gap-free daily balance series from date-ordered transactions."""
+        # Last balance of each day, carried forward over days without transactions
+        return transactions.set_index('date')[['balance']].resample('D').last().ffill()
     
     def train_forecast_model(self, user_id: int, db: Session) -> Dict[str, any]:
         """Train forecasting model for a specific user."""
         daily_balance = self.prepare_time_series(user_id, db)
-        
+        return self.fit_forecast_model(user_id, daily_balance)
+    
+    def fit_forecast_model(self, user_id: int, daily_balance: Optional[pd.DataFrame]) -> Dict[str, any]:
+        """Fit and save a user's forecasting model from their daily balance series."""
         if daily_balance is None or len(daily_balance) < 7:
             return {"error": "Insufficient data for forecasting"}
         
         try:
-            # Convert to Darts TimeSeries
-            ts = TimeSeries.from_dataframe(
-                daily_balance.reset_index(),
-                time_col='date',
-                value_cols=['balance']
-            )
-            
             # Train model
-            self.model.fit(ts)
+            model = ExponentialSmoothing(
+                daily_balance['balance'].to_numpy(),
+                trend='add',
+                seasonal='add',
+                seasonal_periods=SEASONAL_PERIODS
+            ).fit()
             
             # Save model
             os.makedirs("ml_models", exist_ok=True)
             with open(f"ml_models/forecast_user_{user_id}.pkl", "wb") as f:
-                pickle.dump(self.model, f)
+                pickle.dump(model, f)
             
             return {
                 "status": "success",
@@ -84,31 +90,23 @@ class BalanceForecasting:
     def generate_forecast(self, user_id: int, db: Session, days: int = 30) -> Dict[str, any]:
         """Generate balance forecast for a user."""
         try:
-            # Load model
-            with open(f"ml_models/forecast_user_{user_id}.pkl", "rb") as f:
-                model = pickle.load(f)
+            # Load model, reusing the cached copy while the file is unchanged
+            path = f"ml_models/forecast_user_{user_id}.pkl"
+            model = _load_forecast_model(path, os.stat(path).st_mtime_ns)
             
             # Get recent data for context
             daily_balance = self.prepare_time_series(user_id, db)
             if daily_balance is None:
                 return {"error": "No transaction data available"}
             
-            # Convert to Darts TimeSeries
-            ts = TimeSeries.from_dataframe(
-                daily_balance.reset_index(),
-                time_col='date',
-                value_cols=['balance']
-            )
-            
             # Generate forecast
-            forecast = model.predict(n=days)
-            
-            # Convert forecast to DataFrame
-            forecast_df = forecast.pd_dataframe()
-            forecast_df.index = pd.date_range(
-                start=daily_balance.index.max() + timedelta(days=1),
-                periods=days,
-                freq='D'
+            forecast_df = pd.DataFrame(
+                {'balance': model.forecast(days)},
+                index=pd.date_range(
+                    start=daily_balance.index.max() + timedelta(days=1),
+                    periods=days,
+                    freq='D'
+                )
             )
             
             # Calculate trend and summary
@@ -150,14 +148,11 @@ class BalanceForecasting:
         change_percent = (balance_change / current_balance) * 100 if current_balance != 0 else 0
         
         # Find when balance might go below certain thresholds
-        low_balance_days = None
-        critical_balance_days = None
-        
-        for i, balance in enumerate(forecast_df['balance']):
-            if balance < 1000 and low_balance_days is None:
-                low_balance_days = i + 1
-            if balance < 500 and critical_balance_days is None:
-                critical_balance_days = i + 1
+        balances = forecast_df['balance'].to_numpy()
+        below_low = balances < 1000
+        below_critical = balances < 500
+        low_balance_days = int(below_low.argmax()) + 1 if below_low.any() else None
+        critical_balance_days = int(below_critical.argmax()) + 1 if below_critical.any() else None
         
         summary_parts = []
         
@@ -3,22 +3,98 @@ Product recommendation system using semantic search.
 """
 import numpy as np
 import pandas as pd
+import torch
 from sentence_transformers import SentenceTransformer
 import faiss
 import pickle
 import os
+import re
+import threading
 from typing import List, Dict, Tuple
 from sqlalchemy.orm import Session
 from ..database.models import Product, User
 
 
+# Sentence encoder shared by every ProductRecommendation in the process
+_sentence_model = None
+
+
+def get_sentence_model() -> SentenceTransformer:
+    """Load the sentence encoder once per process."""
+    global _sentence_model
+    if _sentence_model is None:
+        model = SentenceTransformer('all-MiniLM-L6-v2')
+        if model.device.type == "cpu":
+            # int8 dynamic quantization of the linear layers speeds up CPU encoding
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        _sentence_model = model
+    return _sentence_model
+
+
+# Saved FAISS index and row -> product id mapping
+INDEX_PATH = "ml_models/product_index.faiss"
+MAPPING_PATH = "ml_models/product_mapping.pkl"
+
+# Catalog size from which an approximate HNSW graph replaces exact search
+HNSW_MIN_PRODUCTS = 10_000
+HNSW_NEIGHBORS = 32
+HNSW_EF_CONSTRUCTION = 200
+
+# Forecast summary keywords, each group matched in a single regex pass
+NEEDS_CREDIT_WORDS = re.compile(r"decreasing|drop|low|warning")
+HAS_SURPLUS_WORDS = re.compile(r"increasing|positive|stable")
+CREDIT_QUERY_WORDS = re.compile(r"decreasing|warning")
+GROWTH_QUERY_WORDS = re.compile(r"increasing|positive")
+
+# Product tag patterns behind each filtering rule
+CREDIT_TAGS = re.compile(r"credit|loan|budgeting")
+SURPLUS_TAGS = re.compile(r"investment|savings|high-yield")
+CLUSTER_TAGS = {
+    "Frugal Savers": re.compile(r"low-fee|savings|conservative"),
+    "High-Value Transactors": re.compile(r"premium|rewards|high-limit"),
+    "Average Spenders": re.compile(r"standard|balanced|everyday")
+}
+
+
 class ProductRecommendation:
     """Product recommendation using semantic search and rule-based filtering."""
     
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = get_sentence_model()
         self.index = None
         self.product_mapping = {}
+        self._index_version = None
+        self._lock = threading.RLock()
+        self._load_index()
+    
+    @staticmethod
+    def _saved_index_version():
+        """Modification times of the saved index and mapping, or None if either is missing."""
+        try:
+            return os.stat(INDEX_PATH).st_mtime_ns, os.stat(MAPPING_PATH).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def _load_index(self):
+        """Load the saved index and mapping if either changed since the last load."""
+        # Taken before reading, so a rebuild that lands mid-read triggers another load
+        version = self._saved_index_version()
+        if version is None:
+            return
+        
+        with self._lock:
+            if version == self._index_version:
+                return
+            try:
+                index = faiss.read_index(INDEX_PATH)
+                with open(MAPPING_PATH, "rb") as f:
+                    product_mapping = pickle.load(f)
+            except (FileNotFoundError, RuntimeError):
+                return
+            self.index, self.product_mapping = index, product_mapping
+            self._index_version = version
     
     def build_product_embeddings(self, db: Session) -> Dict[str, any]:
         """Build FAISS index from product descriptions."""
@@ -40,26 +116,43 @@ class ProductRecommendation:
             product_texts.append(text)
             product_ids.append(product.id)
         
-        # Generate embeddings
-        embeddings = self.model.encode(product_texts)
+        # Generate unit-length embeddings, so inner product is cosine similarity
+        embeddings = self.model.encode(
+            product_texts,
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype('float32')
         
         # Build FAISS index
         dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dimension)  # Inner product for similarity
+        if len(products) >= HNSW_MIN_PRODUCTS:
+            index = faiss.IndexHNSWFlat(dimension, HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        else:
+            index = faiss.IndexFlatIP(dimension)  # Inner product for similarity
         
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(embeddings)
-        self.index.add(embeddings.astype('float32'))
+        index.add(embeddings)
         
         # Create product mapping
-        self.product_mapping = {i: product_id for i, product_id in enumerate(product_ids)}
-        
-        # Save index and mapping
-        os.makedirs("ml_models", exist_ok=True)
-        faiss.write_index(self.index, "ml_models/product_index.faiss")
+        product_mapping = {i: product_id for i, product_id in enumerate(product_ids)}
         
-        with open("ml_models/product_mapping.pkl", "wb") as f:
-            pickle.dump(self.product_mapping, f)
+        with self._lock:
+            # Write both files aside and rename them into place, so other workers
+            # never read a partial file; a load that mixes old and new sees new mtimes
+            # on its next call and reloads the matching pair
+            os.makedirs("ml_models", exist_ok=True)
+            suffix = f".{os.getpid()}.tmp"
+            faiss.write_index(index, INDEX_PATH + suffix)
+            with open(MAPPING_PATH + suffix, "wb") as f:
+                pickle.dump(product_mapping, f)
+            os.replace(MAPPING_PATH + suffix, MAPPING_PATH)
+            os.replace(INDEX_PATH + suffix, INDEX_PATH)
+            
+            # Swap the new index in for subsequent searches
+            self.index, self.product_mapping = index, product_mapping
+            self._index_version = self._saved_index_version()
         
         return {
             "status": "success",
@@ -76,12 +169,11 @@ class ProductRecommendation:
         top_k: int = 5
     ) -> List[Dict[str, any]]:
         """Get product recommendations for a user."""
-        try:
-            # Load index and mapping
-            self.index = faiss.read_index("ml_models/product_index.faiss")
-            with open("ml_models/product_mapping.pkl", "rb") as f:
-                self.product_mapping = pickle.load(f)
-        except FileNotFoundError:
+        # Pick up an index rebuilt by another process, then search a consistent pair
+        self._load_index()
+        with self._lock:
+            index, product_mapping = self.index, self.product_mapping
+        if index is None:
             return []
         
         # Get all products for filtering
@@ -100,21 +192,34 @@ class ProductRecommendation:
         query = self._generate_search_query(user_cluster, forecast_summary)
         
         # Semantic search
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
-        
-        # Search in FAISS index
-        scores, indices = self.index.search(query_embedding.astype('float32'), len(self.product_mapping))
+        query_embedding = self.model.encode(
+            [query], convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+        ).astype('float32')
         
-        # Filter results to only include rule-filtered products
+        # Restrict the FAISS search to the rule-filtered products' index rows
         filtered_product_ids = {p.id for p in filtered_products}
+        rows = np.fromiter(
+            (row for row, product_id in product_mapping.items() if product_id in filtered_product_ids),
+            dtype='int64'
+        )
+        if rows.size == 0:
+            return []
+        k = min(top_k, rows.size)
+        if isinstance(index, faiss.IndexHNSW):
+            scores, indices = self._search_hnsw_rows(index, rows, query_embedding, k)
+        else:
+            selector = faiss.IDSelectorBatch(rows.size, faiss.swig_ptr(rows))
+            scores, indices = index.search(
+                query_embedding, k, params=faiss.SearchParameters(sel=selector)
+            )
+        
         recommendations = []
         
         for score, idx in zip(scores[0], indices[0]):
             if idx == -1:  # Invalid index
                 continue
                 
-            product_id = self.product_mapping[idx]
+            product_id = product_mapping[idx]
             if product_id in filtered_product_ids:
                 product = products_dict[product_id]
                 recommendations.append({
@@ -134,6 +239,26 @@ class ProductRecommendation:
         
         return recommendations
     
+    @staticmethod
+    def _search_hnsw_rows(
+        index, rows: np.ndarray, query_embedding: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the top k of the given rows in an HNSW index, shaped like a FAISS search result."""
+        if rows.size > HNSW_MIN_PRODUCTS:
+            # Widen the graph walk in proportion to how many rows the filter rejects
+            selector = faiss.IDSelectorBatch(rows.size, faiss.swig_ptr(rows))
+            ef_search = min(index.ntotal, max(k, index.hnsw.efSearch) * -(-index.ntotal // rows.size))
+            scores, indices = index.search(
+                query_embedding, k, params=faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+            )
+            if (indices[0] >= 0).sum() == k:
+                return scores, indices
+        
+        # Selective filters leave too few reachable rows in the graph, so score them exactly
+        row_scores = index.reconstruct_batch(rows) @ query_embedding[0]
+        top = np.argsort(-row_scores)[:k]
+        return row_scores[top][np.newaxis], rows[top][np.newaxis]
+    
     def _filter_products_by_rules(
         self, 
         products: List[Product], 
@@ -141,42 +266,27 @@ class ProductRecommendation:
         forecast_summary: str
     ) -> List[Product]:
         """Apply rule-based filtering based on user profile."""
-        filtered = []
-        
         # Determine user needs based on forecast
-        needs_credit = any(word in forecast_summary.lower() for word in ['decreasing', 'drop', 'low', 'warning'])
-        has_surplus = any(word in forecast_summary.lower() for word in ['increasing', 'positive', 'stable'])
+        summary = forecast_summary.lower()
+        needs_credit = NEEDS_CREDIT_WORDS.search(summary) is not None
+        has_surplus = HAS_SURPLUS_WORDS.search(summary) is not None
         
-        for product in products:
-            include = False
-            
-            # Filter by forecast-based needs
-            if needs_credit:
-                if any(tag in (product.tags or "").lower() for tag in ['credit', 'loan', 'budgeting']):
-                    include = True
-            elif has_surplus:
-                if any(tag in (product.tags or "").lower() for tag in ['investment', 'savings', 'high-yield']):
-                    include = True
-            
-            # Filter by cluster preferences
-            if user_cluster == "Frugal Savers":
-                if any(tag in (product.tags or "").lower() for tag in ['low-fee', 'savings', 'conservative']):
-                    include = True
-            elif user_cluster == "High-Value Transactors":
-                if any(tag in (product.tags or "").lower() for tag in ['premium', 'rewards', 'high-limit']):
-                    include = True
-            elif user_cluster == "Average Spenders":
-                if any(tag in (product.tags or "").lower() for tag in ['standard', 'balanced', 'everyday']):
-                    include = True
-            
-            # Include products with matching target cluster
-            if product.target_cluster and user_cluster.lower() in product.target_cluster.lower():
-                include = True
-            
-            if include:
-                filtered.append(product)
+        # Collect the tag patterns that apply, forecast-based needs first, then cluster preferences
+        tag_patterns = []
+        if needs_credit:
+            tag_patterns.append(CREDIT_TAGS)
+        elif has_surplus:
+            tag_patterns.append(SURPLUS_TAGS)
+        if user_cluster in CLUSTER_TAGS:
+            tag_patterns.append(CLUSTER_TAGS[user_cluster])
+        cluster = user_cluster.lower()
         
-        return filtered
+        # Keep products matching any tag pattern or targeting the user's cluster
+        return [
+            product for product in products
+            if any(pattern.search((product.tags or "").lower()) for pattern in tag_patterns)
+            or (product.target_cluster and cluster in product.target_cluster.lower())
+        ]
     
     def _generate_search_query(self, user_cluster: str, forecast_summary: str) -> str:
         """Generate search query based on user profile."""
@@ -193,9 +303,10 @@ class ProductRecommendation:
             query_parts.append("beginner friendly basic banking")
         
         # Add forecast-based terms
-        if "decreasing" in forecast_summary.lower() or "warning" in forecast_summary.lower():
+        summary = forecast_summary.lower()
+        if CREDIT_QUERY_WORDS.search(summary):
             query_parts.append("credit line loan budgeting tool financial assistance")
-        elif "increasing" in forecast_summary.lower() or "positive" in forecast_summary.lower():
+        elif GROWTH_QUERY_WORDS.search(summary):
             query_parts.append("investment savings high yield growth")
         
         return " ".join(query_parts)
\ No newline at end of file
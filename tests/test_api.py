@@ -1,89 +1,81 @@
 """
 Unit and integration tests for the Financial Assistant API.
 """
+import functools
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-import sys
-import os
+from sqlalchemy.pool import StaticPool
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import ANY
 
-# Add parent directory to path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from src.api.main import app
+import src.api.main
+from src.api.chat_service import STREAM_INTERRUPTED_MESSAGE
+from src.api.main import (
+    app, chat_service, clustering_service, forecasting_service, recommendation_service
+)
 from src.database.base import get_db
-from src.database.models import Base, User, Product
-from src.core.security import hash_password
+from src.database.models import Base, User, Product, Transaction, ChatHistory, TrainingJob
+from src.core.security import create_access_token, hash_password
+from scripts.ingest_data import ingest_transaction_data
 
-# Test database
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# Test database, in memory on a single shared connection
+SQLALCHEMY_DATABASE_URL = "sqlite://"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Create test database
-Base.metadata.create_all(bind=engine)
 
+@event.listens_for(engine, "connect")
+def disable_pysqlite_transactions(dbapi_connection, connection_record):
+    """Let SQLAlchemy emit BEGIN itself so savepoints and rollbacks work."""
+    dbapi_connection.isolation_level = None
 
-def override_get_db():
-    """Override database dependency for testing."""
-    try:
-        db = TestingSessionLocal()
-        yield db
-    finally:
-        db.close()
 
-
-app.dependency_overrides[get_db] = override_get_db
+@event.listens_for(engine, "begin")
+def begin_sqlite_transaction(connection):
+    """Start the transaction that pysqlite no longer begins on its own."""
+    connection.exec_driver_sql("BEGIN")
 
 client = TestClient(app)
 
 
-@pytest.fixture
-def test_db():
-    """Create a test database session."""
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@functools.lru_cache(maxsize=None)
+def cached_hash_password(password: str) -> str:
+    """Hash each fixture password once per session; bcrypt dominates fixture setup."""
+    return hash_password(password)
 
 
-@pytest.fixture
-def test_admin_user(test_db):
-    """Create a test admin user."""
+@pytest.fixture(scope="session")
+def test_schema():
+    """Create the test database schema once per session."""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="session")
+def seed_db(test_schema):
+    """Commit the test users and products once; each test's rollback leaves them in place."""
     admin = User(
         username="test_admin",
         email="admin@test.com",
-        hashed_password=hash_password("admin123"),
+        hashed_password=cached_hash_password("admin123"),
         role="admin",
         full_name="Test Admin"
     )
-    test_db.add(admin)
-    test_db.commit()
-    test_db.refresh(admin)
-    return admin
-
-
-@pytest.fixture
-def test_customer_user(test_db):
-    """Create a test customer user."""
     customer = User(
         username="test_customer",
         email="customer@test.com",
-        hashed_password=hash_password("customer123"),
+        hashed_password=cached_hash_password("customer123"),
         role="customer",
         full_name="Test Customer"
     )
-    test_db.add(customer)
-    test_db.commit()
-    test_db.refresh(customer)
-    return customer
-
-
-@pytest.fixture
-def test_products(test_db):
-    """Create test products."""
     products = [
         Product(
             name="Test Savings Account",
@@ -105,22 +97,98 @@ def test_products(test_db):
         )
     ]
     
-    for product in products:
-        test_db.add(product)
-    
-    test_db.commit()
-    return products
+    db = TestingSessionLocal()
+    try:
+        db.add_all([admin, customer, *products])
+        # Read the ids after the flush, commit would expire them and reload each row
+        db.flush()
+        ids = {
+            "admin": admin.id,
+            "customer": customer.id,
+            "products": [product.id for product in products]
+        }
+        db.commit()
+        return ids
+    finally:
+        db.close()
 
 
-def get_auth_token(username: str, password: str):
-    """Get authentication token for testing."""
-    response = client.post(
-        "/token",
-        data={"username": username, "password": password}
+@pytest.fixture(autouse=True)
+def test_db(seed_db, monkeypatch):
+    """Run each test in a transaction that is rolled back afterwards."""
+    connection = engine.connect()
+    transaction = connection.begin()
+    session_factory = sessionmaker(
+        autocommit=False, autoflush=False, bind=connection, join_transaction_mode="create_savepoint"
     )
-    if response.status_code == 200:
-        return response.json()["access_token"]
-    return None
+    db = session_factory()
+    
+    def override_get_db():
+        """Override database dependency with the test's session."""
+        yield db
+    
+    # Sessions the app opens itself, e.g. in background tasks, join the same transaction
+    app.dependency_overrides[get_db] = override_get_db
+    monkeypatch.setattr(src.api.main, "SessionLocal", session_factory)
+    try:
+        yield db
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture
+def test_admin_user(test_db, seed_db):
+    """Get the test admin user."""
+    return test_db.get(User, seed_db["admin"])
+
+
+@pytest.fixture
+def test_customer_user(test_db, seed_db):
+    """Get the test customer user."""
+    return test_db.get(User, seed_db["customer"])
+
+
+@pytest.fixture
+def test_products(test_db, seed_db):
+    """Get the test products."""
+    return [test_db.get(Product, product_id) for product_id in seed_db["products"]]
+
+
+CANNED_CHAT_RESPONSE = "Here is some canned financial advice."
+
+
+@pytest.fixture
+def fake_chat(monkeypatch):
+    """Replace the language model with a canned response."""
+    async def generate_response(**kwargs):
+        return CANNED_CHAT_RESPONSE
+    
+    async def stream_response(**kwargs):
+        for word in CANNED_CHAT_RESPONSE.split(" "):
+            yield word + " "
+    
+    monkeypatch.setattr(chat_service, "generate_response", generate_response)
+    monkeypatch.setattr(chat_service, "stream_response", stream_response)
+
+
+def auth_headers(username: str):
+    """Authorization headers carrying a freshly minted token for a user."""
+    return {"Authorization": f"Bearer {create_access_token(data={'sub': username})}"}
+
+
+@pytest.fixture(scope="session")
+def admin_headers(seed_db):
+    """Authorization headers for the seeded admin, minted once per session."""
+    return auth_headers("test_admin")
+
+
+@pytest.fixture(scope="session")
+def customer_headers(seed_db):
+    """Authorization headers for the seeded customer, minted once per session."""
+    return auth_headers("test_customer")
 
 
 class TestAuthentication:
@@ -137,6 +205,18 @@ class TestAuthentication:
         assert "access_token" in data
         assert data["token_type"] == "bearer"
     
+    def test_login_with_context(self, test_customer_user):
+        """Test login that also returns the dashboard context."""
+        response = client.post(
+            "/token-with-context",
+            data={"username": "test_customer", "password": "customer123"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert "access_token" in data
+        assert data["context"]["user"]["username"] == "test_customer"
+        assert "forecast" in data["context"]
+    
     def test_login_invalid_credentials(self):
         """Test login with invalid credentials."""
         response = client.post(
@@ -152,127 +232,291 @@ class TestAuthentication:
         assert response.status_code == 401
 
 
-class TestCustomerEndpoints:
-    """Test customer-specific endpoints."""
+class TestProtectedEndpoints:
+    """Test authenticated GET endpoints by role."""
     
-    def test_get_current_user(self, test_customer_user):
-        """Test getting current user information."""
-        token = get_auth_token("test_customer", "customer123")
-        assert token is not None
-        
-        response = client.get(
-            "/api/users/me",
-            headers={"Authorization": f"Bearer {token}"}
-        )
-        assert response.status_code == 200
+    @pytest.mark.parametrize("headers,endpoint,expected_status,expected_fields", [
+        ("customer_headers", "/api/users/me", 200, {"username": "test_customer", "role": "customer"}),
+        ("customer_headers", "/api/users/me/context", 200, {
+            "user": ANY, "transactions": ANY, "category_spending": ANY,
+            "forecast": ANY, "recommendations": ANY
+        }),
+        ("customer_headers", "/api/users/me/context/recommendations", 200, {"recommendations": ANY}),
+        ("admin_headers", "/api/admin/dashboard", 200, {
+            "total_users": ANY, "total_transactions": ANY, "cluster_distribution": ANY,
+            "avg_transaction_value": ANY, "total_balance": ANY
+        }),
+        ("customer_headers", "/api/admin/dashboard", 403, {"detail": "Admin access required"}),
+    ])
+    def test_protected_endpoint(self, request, headers, endpoint, expected_status, expected_fields):
+        """Test an endpoint's status and response fields for a given user."""
+        response = client.get(endpoint, headers=request.getfixturevalue(headers))
+        assert response.status_code == expected_status
         data = response.json()
-        assert data["username"] == "test_customer"
-        assert data["role"] == "customer"
+        for key, value in expected_fields.items():
+            assert data[key] == value
+
+
+class TestCustomerEndpoints:
+    """Test customer-specific endpoints."""
     
-    def test_get_user_context(self, test_customer_user):
-        """Test getting user context."""
-        token = get_auth_token("test_customer", "customer123")
-        assert token is not None
-        
+    def test_get_user_context_summary(self, customer_headers):
+        """Test getting user context without recommendations."""
         response = client.get(
-            "/api/users/me/context",
-            headers={"Authorization": f"Bearer {token}"}
+            "/api/users/me/context/summary",
+            headers=customer_headers
         )
         assert response.status_code == 200
         data = response.json()
         assert "user" in data
-        assert "transactions" in data
         assert "forecast" in data
-        assert "recommendations" in data
+        assert "recommendations" not in data
     
-    def test_chat_endpoint(self, test_customer_user):
+    def test_chat_endpoint(self, test_db, test_customer_user, fake_chat, customer_headers):
         """Test chat endpoint."""
-        token = get_auth_token("test_customer", "customer123")
-        assert token is not None
-        
         response = client.post(
             "/api/chat",
-            headers={"Authorization": f"Bearer {token}"},
+            headers=customer_headers,
             json={"message": "Hello, can you help me with my finances?"}
         )
         assert response.status_code == 200
         data = response.json()
-        assert "response" in data
+        assert data["response"] == CANNED_CHAT_RESPONSE
         assert "timestamp" in data
+        
+        # History is saved in a background task after the response
+        saved = test_db.query(ChatHistory).filter(
+            ChatHistory.user_id == test_customer_user.id
+        ).one()
+        assert saved.ai_response == data["response"]
+    
+    def test_chat_stream_endpoint(self, fake_chat, customer_headers):
+        """Test streaming chat endpoint."""
+        response = client.post(
+            "/api/chat/stream",
+            headers=customer_headers,
+            json={"message": "Hello, can you help me with my finances?"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert response.text.strip() == CANNED_CHAT_RESPONSE
+    
+    def test_chat_stream_interrupted(
+        self, test_db, test_customer_user, customer_headers, monkeypatch, capsys
+    ):
+        """Test a model failing mid-stream ends the response with an error notice."""
+        class FailingStream:
+            """Gemini stream that raises after its first chunk."""
+            
+            async def __aiter__(self):
+                yield SimpleNamespace(text="Here is the first part")
+                raise RuntimeError("connection reset")
+        
+        class FailingModel:
+            """Gemini model whose streamed responses fail part way."""
+            
+            async def generate_content_async(self, prompt, stream=False):
+                return FailingStream()
+        
+        monkeypatch.setattr(chat_service, "model", FailingModel())
+        response = client.post(
+            "/api/chat/stream",
+            headers=customer_headers,
+            json={"message": "Hello, can you help me with my finances?"}
+        )
+        assert response.status_code == 200
+        assert response.text == "Here is the first part" + STREAM_INTERRUPTED_MESSAGE
+        assert "Gemini API error: connection reset" in capsys.readouterr().out
+        
+        # The partial response and notice are what gets saved
+        saved = test_db.query(ChatHistory).filter(
+            ChatHistory.user_id == test_customer_user.id
+        ).one()
+        assert saved.ai_response == response.text
 
 
 class TestAdminEndpoints:
     """Test admin-specific endpoints."""
     
-    def test_admin_dashboard(self, test_admin_user, test_customer_user):
-        """Test admin dashboard endpoint."""
-        token = get_auth_token("test_admin", "admin123")
-        assert token is not None
+    def test_admin_dashboard_uses_latest_balance(self, test_db, test_customer_user, admin_headers):
+        """Test total balance sums each user's most recent balance."""
+        test_db.add_all([
+            Transaction(user_id=test_customer_user.id, date=datetime(2024, 1, 1),
+                        category="Salary", debit=0.0, credit=1000.0, balance=1000.0),
+            Transaction(user_id=test_customer_user.id, date=datetime(2024, 1, 2),
+                        category="Rent", debit=600.0, credit=0.0, balance=400.0)
+        ])
+        test_db.commit()
         
         response = client.get(
             "/api/admin/dashboard",
-            headers={"Authorization": f"Bearer {token}"}
+            headers=admin_headers
         )
         assert response.status_code == 200
         data = response.json()
-        assert "total_users" in data
-        assert "total_transactions" in data
-        assert "cluster_distribution" in data
-        assert "avg_transaction_value" in data
-        assert "total_balance" in data
+        assert data["total_transactions"] == 2
+        assert data["total_balance"] == 400.0
+        assert data["avg_transaction_value"] == 300.0
     
-    def test_admin_users_list(self, test_admin_user, test_customer_user):
+    def test_admin_users_list(self, admin_headers):
         """Test admin users list endpoint."""
-        token = get_auth_token("test_admin", "admin123")
-        assert token is not None
-        
         response = client.get(
             "/api/admin/users",
-            headers={"Authorization": f"Bearer {token}"}
+            headers=admin_headers
         )
         assert response.status_code == 200
         data = response.json()
         assert "users" in data
         assert len(data["users"]) >= 1
+        assert data["total"] >= 1
+        assert "cluster_name" in data["users"][0]
     
-    def test_customer_cannot_access_admin_endpoints(self, test_customer_user):
-        """Test that customers cannot access admin endpoints."""
-        token = get_auth_token("test_customer", "customer123")
-        assert token is not None
-        
+    def test_admin_users_list_pagination(self, admin_headers):
+        """Test admin users list honours page size."""
         response = client.get(
-            "/api/admin/dashboard",
-            headers={"Authorization": f"Bearer {token}"}
+            "/api/admin/users",
+            headers=admin_headers,
+            params={"page": 1, "page_size": 1}
         )
-        assert response.status_code == 403
-        assert "Admin access required" in response.json()["detail"]
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["users"]) == 1
+        assert data["page_size"] == 1
+    
+    def test_admin_bootstrap(self, admin_headers):
+        """Test admin bootstrap endpoint."""
+        response = client.get(
+            "/api/admin/bootstrap",
+            headers=admin_headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert "total_users" in data["dashboard"]
+        assert len(data["users"]["users"]) >= 1
+        assert "clustering_trained" in data["model_status"]
+        assert "forecast_models" in data["model_status"]
 
 
 class TestMLEndpoints:
     """Test ML model training endpoints."""
     
-    def test_train_clustering_model(self, test_admin_user, test_customer_user):
+    @pytest.fixture(autouse=True)
+    def fake_training(self, monkeypatch):
+        """Replace model fitting with stubs returning the real result shapes."""
+        monkeypatch.setattr(clustering_service, "train_cluster_model", lambda db: {
+            "silhouette_score": 0.5, "n_clusters": 4, "n_users": 1
+        })
+        monkeypatch.setattr(recommendation_service, "build_product_embeddings", lambda db: {
+            "status": "success", "n_products": 2, "embedding_dimension": 384
+        })
+        monkeypatch.setattr(forecasting_service, "train_forecast_model", lambda user_id, db: {
+            "status": "success", "data_points": 30, "date_range": "2024-01-01 to 2024-01-30"
+        })
+    
+    def test_train_clustering_model(self, admin_headers):
         """Test clustering model training."""
-        token = get_auth_token("test_admin", "admin123")
-        assert token is not None
-        
         response = client.post(
             "/api/admin/train-clustering",
-            headers={"Authorization": f"Bearer {token}"}
+            headers=admin_headers
         )
-        assert response.status_code == 200
-        # Note: May return error due to insufficient data in test environment
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        
+        response = client.get(
+            f"/api/admin/jobs/{job_id}",
+            headers=admin_headers
+        )
+        assert response.json()["status"] == "completed"
+        assert response.json()["result"]["n_clusters"] == 4
     
-    def test_train_recommendation_model(self, test_admin_user, test_products):
+    def test_train_recommendation_model(self, test_products, admin_headers):
         """Test recommendation model training."""
-        token = get_auth_token("test_admin", "admin123")
-        assert token is not None
-        
         response = client.post(
             "/api/admin/train-recommendations",
-            headers={"Authorization": f"Bearer {token}"}
+            headers=admin_headers
+        )
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        
+        # The test client runs background tasks before returning
+        response = client.get(
+            f"/api/admin/jobs/{job_id}",
+            headers=admin_headers
         )
         assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "completed"
+        assert data["result"]["status"] == "success"
+    
+    def test_train_forecasting_model(self, test_customer_user, admin_headers):
+        """Test forecasting model training for one user."""
+        response = client.post(
+            f"/api/admin/train-forecasting/{test_customer_user.id}",
+            headers=admin_headers
+        )
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        
+        response = client.get(
+            f"/api/admin/jobs/{job_id}",
+            headers=admin_headers
+        )
+        assert response.json()["status"] == "completed"
+    
+    def test_training_rejected_while_running(self, test_db, admin_headers):
+        """Test a second job of the same kind is refused while one is active."""
+        test_db.add(TrainingJob(id="running", kind="clustering", status="running"))
+        test_db.commit()
+        
+        response = client.post(
+            "/api/admin/train-clustering",
+            headers=admin_headers
+        )
+        assert response.status_code == 409
+    
+    def test_expired_training_jobs_evicted(self, test_db, admin_headers):
+        """Test jobs past their TTL are dropped when a new job is queued."""
+        test_db.add(TrainingJob(
+            id="expired", kind="clustering", status="running",
+            created_at=datetime.utcnow() - timedelta(days=1)
+        ))
+        test_db.commit()
+        
+        response = client.post(
+            "/api/admin/train-clustering",
+            headers=admin_headers
+        )
+        assert response.status_code == 202
+        
+        response = client.get(
+            "/api/admin/jobs/expired",
+            headers=admin_headers
+        )
+        assert response.status_code == 404
+    
+    def test_unknown_training_job(self, admin_headers):
+        """Test polling a job that does not exist."""
+        response = client.get(
+            "/api/admin/jobs/missing",
+            headers=admin_headers
+        )
+        assert response.status_code == 404
+
+
+class TestDataIngestion:
+    """Test transaction CSV ingestion."""
+    
+    def test_header_only_csv(self, test_db, test_customer_user, tmp_path, monkeypatch, capsys):
+        """Test a CSV without rows ingests nothing and raises no error."""
+        data_dir = tmp_path / "data" / "sample_transactions"
+        data_dir.mkdir(parents=True)
+        (data_dir / "test_customer.csv").write_text("date,category,debit,credit,balance\n")
+        monkeypatch.chdir(tmp_path)
+        
+        ingest_transaction_data(test_db)
+        
+        assert "0 transactions for user test_customer" in capsys.readouterr().out
+        assert test_db.query(Transaction).filter(Transaction.user_id == test_customer_user.id).count() == 0
 
 
 class TestHealthCheck:
@@ -286,9 +530,3 @@ class TestHealthCheck:
         assert data["status"] == "healthy"
         assert "service" in data
 
-
-# Cleanup
-def teardown_module():
-    """Clean up test database."""
-    if os.path.exists("test.db"):
-        os.remove("test.db")
\ No newline at end of file
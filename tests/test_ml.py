@@ -0,0 +1,213 @@
+"""
+Unit tests for the ML services.
+"""
+import pickle
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.cluster import KMeans
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import src.ml.forecasting
+from src.database.models import Base, User, Transaction
+from src.ml.clustering import CustomerClustering, SPENDING_CATEGORIES
+from src.ml.forecasting import BalanceForecasting
+
+
+@pytest.fixture(scope="module")
+def ml_db():
+    """In-memory database with seeded, deterministic transactions for three customers."""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    
+    rng = np.random.default_rng(7)
+    users = [
+        User(username=f"customer_{i}", email=f"customer_{i}@test.com",
+             hashed_password="x", role="customer")
+        for i in range(3)
+    ]
+    users.append(User(username="admin", email="admin@test.com", hashed_password="x", role="admin"))
+    db.add_all(users)
+    db.flush()
+    
+    # The last customer has no transactions; the others skip a few days in the middle
+    start = datetime(2024, 1, 1)
+    days = np.setdiff1d(np.arange(60), np.arange(20, 25))
+    for user in users[:2]:
+        balance = 5000.0
+        for offset in np.sort(rng.choice(days, size=150)):
+            debit = round(float(rng.lognormal(3, 1)), 2)
+            credit = 500.0 if rng.random() < 0.05 else 0.0
+            balance += credit - debit
+            db.add(Transaction(
+                user_id=user.id,
+                date=start + timedelta(days=int(offset), minutes=int(rng.integers(1440))),
+                category=str(rng.choice(SPENDING_CATEGORIES + ['Other'])),
+                debit=debit,
+                credit=credit,
+                balance=balance
+            ))
+    db.commit()
+    
+    yield db
+    
+    db.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+def legacy_features(user_id, db):
+    """Per-user feature extraction as it was before the bulk rewrite."""
+    transactions = db.query(Transaction).filter(Transaction.user_id == user_id).all()
+    if not transactions:
+        return CustomerClustering()._default_features()
+    
+    df = pd.DataFrame([
+        {'date': t.date, 'category': t.category, 'debit': t.debit, 'balance': t.balance}
+        for t in transactions
+    ])
+    category_spending = df.groupby('category')['debit'].sum()
+    weekday = df['date'].dt.weekday < 5
+    features = {
+        'recency': (pd.Timestamp.now() - df['date'].max()).days,
+        'frequency': len(df),
+        'monetary': df['debit'].sum(),
+        'avg_transaction': df['debit'].mean(),
+        'balance_std': df['balance'].std() if len(df) > 1 else 0,
+        'weekday_ratio': df.loc[weekday, 'debit'].sum() / df['debit'].sum()
+    }
+    for cat in SPENDING_CATEGORIES:
+        features[f'spending_{cat.lower()}'] = category_spending.get(cat, 0) / category_spending.sum()
+    return features
+
+
+def legacy_daily_balance(user_id, db):
+    """Per-row daily balance series as it was before the single-query rewrite."""
+    transactions = db.query(Transaction).filter(
+        Transaction.user_id == user_id
+    ).order_by(Transaction.date).all()
+    if not transactions:
+        return None
+    
+    df = pd.DataFrame([{'date': t.date.date(), 'balance': t.balance} for t in transactions])
+    daily_balance = df.groupby('date')['balance'].last().reset_index()
+    daily_balance['date'] = pd.to_datetime(daily_balance['date'])
+    daily_balance = daily_balance.set_index('date')
+    date_range = pd.date_range(daily_balance.index.min(), daily_balance.index.max(), freq='D')
+    return daily_balance.reindex(date_range).ffill()
+
+
+def legacy_threshold_days(balances):
+    """First forecast day below $1,000 and $500, found with the original loop."""
+    low_balance_days = None
+    critical_balance_days = None
+    for i, balance in enumerate(balances):
+        if balance < 1000 and low_balance_days is None:
+            low_balance_days = i + 1
+        if balance < 500 and critical_balance_days is None:
+            critical_balance_days = i + 1
+    return low_balance_days, critical_balance_days
+
+
+@pytest.fixture
+def user_features():
+    """Seeded, skewed per-user feature matrix with fewer users than one minibatch."""
+    return np.random.default_rng(3).lognormal(size=(300, 12))
+
+
+class TestClustering:
+    """Test customer clustering."""
+    
+    def test_bulk_features_match_per_user(self, ml_db):
+        """Test one bulk query yields the same features as the per-user extraction."""
+        features = CustomerClustering().extract_features_bulk(ml_db, User.role == "customer")
+        
+        customer_ids = [user.id for user in ml_db.query(User).filter(User.role == "customer")]
+        assert features.index.tolist() == customer_ids
+        for user_id in customer_ids:
+            assert features.loc[user_id].to_dict() == pytest.approx(legacy_features(user_id, ml_db))
+    
+    def test_single_user_features(self, ml_db):
+        """Test single-user extraction reads that user's row of the bulk features."""
+        clustering = CustomerClustering()
+        features = clustering.extract_features_bulk(ml_db, User.role == "customer")
+        
+        for user_id in features.index:
+            assert clustering.extract_features(user_id, ml_db) == features.loc[user_id].to_dict()
+    
+    def test_fit_matches_full_kmeans_inertia(self, user_features):
+        """Test MiniBatchKMeans converges as well as full KMeans on a small user base."""
+        scaler, kmeans = CustomerClustering._fit_models(user_features)
+        X_scaled = scaler.transform(user_features)
+        reference = KMeans(n_clusters=4, n_init="auto", random_state=42).fit(X_scaled)
+        
+        inertia = -kmeans.score(X_scaled)
+        assert inertia <= reference.inertia_ * 1.02
+
+
+class TestForecasting:
+    """Test balance forecasting."""
+    
+    @pytest.mark.parametrize("partition_rows", [10_000, 16])
+    def test_time_series_matches_per_row_build(self, ml_db, monkeypatch, partition_rows):
+        """Test the streamed daily balance matches the per-row build, across partitions too."""
+        monkeypatch.setattr(src.ml.forecasting, "TIME_SERIES_PARTITION_ROWS", partition_rows)
+        forecasting = BalanceForecasting()
+        
+        for user in ml_db.query(User).filter(User.role == "customer"):
+            expected = legacy_daily_balance(user.id, ml_db)
+            daily_balance = forecasting.prepare_time_series(user.id, ml_db)
+            if expected is None:
+                assert daily_balance is None
+            else:
+                pd.testing.assert_frame_equal(
+                    daily_balance, expected, check_names=False, check_freq=False
+                )
+    
+    def test_holt_winters_matches_darts(self, tmp_path, monkeypatch):
+        """Test the statsmodels model forecasts like the darts model it replaced."""
+        darts = pytest.importorskip("darts")
+        from darts.models import ExponentialSmoothing
+        monkeypatch.chdir(tmp_path)
+        
+        # Three weeks of a falling balance with a weekly cycle and noise
+        rng = np.random.default_rng(1)
+        steps = np.arange(21)
+        daily_balance = pd.DataFrame(
+            {'balance': 5000 - 40 * steps + 150 * np.sin(2 * np.pi * steps / 7) + rng.normal(scale=20, size=21)},
+            index=pd.date_range("2024-01-01", periods=21, freq="D", name="date")
+        )
+        
+        result = BalanceForecasting().fit_forecast_model(1, daily_balance)
+        assert result["status"] == "success"
+        with open("ml_models/forecast_user_1.pkl", "rb") as f:
+            forecast = pickle.load(f).forecast(30)
+        
+        reference = ExponentialSmoothing()
+        reference.fit(darts.TimeSeries.from_dataframe(
+            daily_balance.reset_index(), time_col='date', value_cols=['balance']
+        ))
+        expected = reference.predict(n=30).pd_dataframe()['balance'].to_numpy()
+        np.testing.assert_allclose(forecast, expected, rtol=1e-6)
+    
+    @pytest.mark.parametrize("final_balance", [1200.0, 800.0, 300.0])
+    def test_threshold_days_match_loop(self, final_balance):
+        """Test the vectorized threshold crossing days match the original loop."""
+        balances = np.linspace(2000.0, final_balance, 30)
+        forecast_df = pd.DataFrame({'balance': balances})
+        low_balance_days, critical_balance_days = legacy_threshold_days(balances)
+        
+        summary = BalanceForecasting()._generate_forecast_summary(
+            2000.0, final_balance, forecast_df, "decreasing"
+        )
+        
+        if critical_balance_days:
+            assert f"below $500 in approximately {critical_balance_days} days" in summary
+        elif low_balance_days:
+            assert f"below $1,000 in approximately {low_balance_days} days" in summary
+        else:
+            assert "remain stable above $1,000" in summary